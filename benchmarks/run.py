@@ -0,0 +1,176 @@
+# 基准测试：生成合成 PDF，分阶段计时 (扫描 / 统计 / 免确认清理 / 保存)，结果写成可对比的 JSON
+# 用法: python -m benchmarks.run -o baseline.json
+#       python -m benchmarks.run --scale 0.2 --only baseline,image-dense --compare baseline.json
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import fitz
+from engine import (ImageHasher, scan_document, resolve_near_duplicates, sampled_scan, aggregate, auto_select, clean_parallel, save_document,
+                    default_workers, peak_rss_mb, SAVE_PROFILES)
+from benchmarks.synthetic import generate
+
+RESULT_VERSION = 1
+PHASES = ("scan", "aggregate", "clean", "save")
+SCENARIOS = {
+    "baseline":         dict(pages=200),
+    "shared-logos":     dict(pages=200, logos=3),
+    "duplicated-logos": dict(pages=200, logos=3, duplicated=True),
+    "header-variants":  dict(pages=200, header_variants=6),
+    "mixed-sizes":      dict(pages=200, mixed_sizes=True),
+    "reencoded-logos":  dict(pages=200, logos=2, reencoded=True),
+    "image-dense":      dict(pages=100, images_per_page=8),
+    "large":            dict(pages=1000, logos=2),
+}
+
+def children_peak_rss_mb():
+    # 已回收子进程 (进程池 worker) 中的最大峰值内存
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return None
+
+def measure(path, out_path, ratio, workers, profile, fast, near=False):
+    # 单个场景在独立进程中执行一次，保证峰值内存互不干扰
+    phases = {}
+    def done(name, start):
+        phases[name] = time.perf_counter() - start
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(abs, range(workers * 2)))  # 预热进程池，启动开销不计入扫描
+        start = time.perf_counter()
+        doc = fitz.open(path); total = len(doc)
+        hasher = ImageHasher(doc)
+        if fast: table = sampled_scan(path, doc, hasher, ratio, executor)
+        else:
+            table = scan_document(path, range(total), executor, near=near)
+            hasher.resolve_aliases(table.img_sigs)
+            if near: resolve_near_duplicates(hasher, table.img_phash)
+            table.apply_aliases(hasher.aliases)
+        done("scan", start)
+        start = time.perf_counter()
+        img_candidates, txt_candidates = aggregate(doc, table, ratio)
+        done("aggregate", start)
+        start = time.perf_counter()
+        hashes, texts = auto_select(img_candidates, txt_candidates)
+        cleaned = clean_parallel(path, doc, hasher, hashes, texts, executor)
+        done("clean", start)
+        start = time.perf_counter()
+        stats = save_document(cleaned, out_path, profile)
+        done("save", start)
+        if cleaned is not doc: cleaned.close()
+        doc.close()
+    return {
+        'pages': total, 'seconds': phases,
+        'candidates': {'images': len(img_candidates), 'texts': len(txt_candidates)},
+        'output_bytes': stats['bytes'],
+        'peak_rss_mb': {'main': peak_rss_mb(), 'workers': children_peak_rss_mb()},
+    }
+
+def run_child(args, name, params, work_dir):
+    path = os.path.join(work_dir, f"{name}.pdf")
+    if not os.path.exists(path): generate(path, **params)
+    report = os.path.join(work_dir, f"{name}.json")
+    cmd = [sys.executable, "-m", "benchmarks.run", "--child", path, os.path.join(work_dir, f"{name}.out.pdf"), report,
+           "--ratio", str(args.ratio), "--workers", str(args.workers), "--profile", args.profile] + (["--fast"] if args.fast else []) + (["--near"] if args.near else [])
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if proc.returncode != 0: raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "benchmark child failed")
+    with open(report, encoding="utf-8") as f: return json.load(f)
+
+def summarize(runs, params):
+    # 多次运行取各阶段最短时间，内存取最大值
+    first = runs[0]; pages = first['pages']
+    phases = {}
+    for name in PHASES:
+        sec = min(r['seconds'][name] for r in runs)
+        phases[name] = {'seconds': round(sec, 4), 'pages_per_s': round(pages / sec, 1) if sec > 0 else None}
+    total = sum(p['seconds'] for p in phases.values())
+    peaks = {k: max((r['peak_rss_mb'][k] or 0) for r in runs) for k in ('main', 'workers')}
+    return {
+        'params': params, 'pages': pages, 'runs': len(runs), 'phases': phases,
+        'total': {'seconds': round(total, 4), 'pages_per_s': round(pages / total, 1) if total > 0 else None},
+        'peak_rss_mb': {k: round(v, 1) for k, v in peaks.items()},
+        'candidates': first['candidates'], 'output_bytes': first['output_bytes'],
+    }
+
+def compare(baseline, current, threshold):
+    # 打印每个场景各阶段的耗时变化，返回超过阈值的回退数量
+    regressions = 0
+    print(f"{'scenario':<18} {'phase':<10} {'base s':>9} {'new s':>9} {'change':>8}")
+    for name, res in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base or base.get('pages') != res['pages']:
+            print(f"{name:<18} (no comparable baseline)"); continue
+        for phase in PHASES + ("total",):
+            old = (base['phases'].get(phase) if phase != "total" else base['total'])['seconds']
+            new = (res['phases'][phase] if phase != "total" else res['total'])['seconds']
+            change = (new - old) / old * 100 if old > 0 else 0.0
+            flag = ""
+            if threshold is not None and change > threshold and phase != "total": regressions += 1; flag = "  <-- regression"
+            print(f"{name:<18} {phase:<10} {old:>9.3f} {new:>9.3f} {change:>+7.1f}%{flag}")
+    return regressions
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Benchmark detection and cleaning on synthetic PDFs")
+    p.add_argument("-o", "--output", help="write results JSON here")
+    p.add_argument("--compare", help="baseline JSON to compare against")
+    p.add_argument("--fail-above", type=float, help="exit with 1 if any phase is slower than the baseline by more than this percent")
+    p.add_argument("--only", help="comma separated scenario names: " + ", ".join(SCENARIOS))
+    p.add_argument("--scale", type=float, default=1.0, help="multiply every scenario's page count")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--ratio", type=float, default=30, help="frequency threshold in percent")
+    p.add_argument("--workers", type=int, default=default_workers())
+    p.add_argument("--profile", choices=sorted(SAVE_PROFILES), default="standard")
+    p.add_argument("--fast", action="store_true", help="benchmark the sampled scan instead of the full scan")
+    p.add_argument("--near", action="store_true", help="include near-duplicate image detection in the scan")
+    p.add_argument("--keep", help="keep generated PDFs in this directory (reused on the next run)")
+    p.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    return p
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.child:
+        res = measure(args.child[0], args.child[1], args.ratio / 100.0, max(1, args.workers), args.profile, args.fast, args.near)
+        with open(args.child[2], "w", encoding="utf-8") as f: json.dump(res, f)
+        return 0
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenario: {', '.join(unknown)}", file=sys.stderr); return 2
+    work_dir = args.keep or tempfile.mkdtemp(prefix="pdfclean_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    result = {
+        'version': RESULT_VERSION,
+        'meta': {'created': time.strftime("%Y-%m-%dT%H:%M:%S"), 'python': platform.python_version(),
+                 'pymupdf': fitz.VersionBind, 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                 'workers': args.workers, 'ratio': args.ratio, 'profile': args.profile, 'fast': args.fast, 'near': args.near, 'scale': args.scale},
+        'scenarios': {},
+    }
+    try:
+        for name in names:
+            params = dict(SCENARIOS[name]); params['pages'] = max(1, int(params['pages'] * args.scale))
+            runs = [run_child(args, name, params, work_dir) for _ in range(max(1, args.repeat))]
+            res = result['scenarios'][name] = summarize(runs, params)
+            print(f">>> {name}: {res['pages']} pages, " + ", ".join(f"{k} {v['seconds']:.3f}s" for k, v in res['phases'].items())
+                  + f", {res['total']['pages_per_s']} pages/s, peak {res['peak_rss_mb']['main']:.0f}/{res['peak_rss_mb']['workers']:.0f} MB",
+                  file=sys.stderr, flush=True)
+    finally:
+        if not args.keep: shutil.rmtree(work_dir, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(result, f, indent=2)
+    elif not args.compare:
+        json.dump(result, sys.stdout, indent=2); print()
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f: baseline = json.load(f)
+        if compare(baseline, result, args.fail_above) and args.fail_above is not None: return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
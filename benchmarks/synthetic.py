@@ -0,0 +1,85 @@
+# 基准测试用的合成 PDF 生成器 (只依赖 PyMuPDF，固定随机种子保证可复现)
+# 用法: python -m benchmarks.synthetic out.pdf --pages 500 --logos 3 --duplicated --header-variants 4 --mixed-sizes
+import sys
+import random
+import argparse
+import fitz
+
+PAGE_SIZES = [(595, 842), (612, 792), (842, 595), (595, 600)]  # A4 / Letter / A4 横向 / 非标准
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+         "et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris").split()
+
+def solid_png(w, h, color, accent):
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, w, h), 0)
+    pix.set_rect(pix.irect, color); pix.set_rect(fitz.IRect(w // 4, h // 4, w // 2, h * 3 // 4), accent)
+    return pix.tobytes("png")
+
+def noise_png(rng, w=48, h=48):
+    # 每页唯一的"内容图"，用来模拟图像密集的扫描件 / 插图
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, w, h), 0)
+    pix.set_rect(pix.irect, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    for _ in range(6):
+        x, y = rng.randrange(w - 8), rng.randrange(h - 8)
+        pix.set_rect(fitz.IRect(x, y, x + 8, y + 8), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    return pix.tobytes("png")
+
+def copy_image(doc, xref):
+    # 复制一份内容完全相同的图像对象 (MuPDF 插入图像时会按内容去重，只能手动复制)
+    new = doc.get_new_xref()
+    doc.update_object(new, doc.xref_object(xref))
+    doc.update_stream(new, doc.xref_stream_raw(xref), new=True, compress=False)
+    return new
+
+def reencode(stream, rng):
+    # 轻微缩放后以随机质量重新编码为 JPEG，模拟各页分别导出的 logo
+    pix = fitz.Pixmap(stream)
+    pix = fitz.Pixmap(pix, pix.width - rng.randrange(6), pix.height - rng.randrange(3), None)
+    return pix.tobytes("jpg", jpg_quality=rng.randrange(50, 95))
+
+def generate(path, pages=200, logos=1, duplicated=False, header_variants=1, mixed_sizes=False, images_per_page=0, seed=0, reencoded=False):
+    # logos: 每页都出现的重复 logo 数量；duplicated=True 时每页重新写入一份相同的图像流 (不同 xref)，否则共用一个 xref
+    # reencoded=True 时每页的 logo 都是重新编码 / 轻微缩放过的版本 (只有近似重复检测能合并)
+    # header_variants: 页眉文字的变体数，按页码分段轮换 (变体越多，单个变体的出现比例越低)
+    # images_per_page: 每页额外插入的唯一图像数量
+    rng = random.Random(seed)
+    doc = fitz.open()
+    streams = [solid_png(60, 30, (200 - 40 * k % 200, 30 + 50 * k % 200, 30), (0, 0, 250 - 30 * k % 250)) for k in range(logos)]
+    shared = [0] * logos
+    for i in range(pages):
+        w, h = rng.choice(PAGE_SIZES) if mixed_sizes else PAGE_SIZES[0]
+        page = doc.new_page(width=w, height=h)
+        for k, stream in enumerate(streams):
+            rect = fitz.Rect(20 + 70 * k, 20, 80 + 70 * k, 50)
+            if reencoded: page.insert_image(rect, stream=reencode(stream, rng))
+            elif not shared[k]: shared[k] = page.insert_image(rect, stream=stream)
+            else: page.insert_image(rect, xref=copy_image(doc, shared[k]) if duplicated else shared[k])
+        for n in range(images_per_page):
+            x, y = 72 + (n % 4) * 110, 300 + (n // 4) * 110
+            page.insert_image(fitz.Rect(x, y, x + 96, y + 96), stream=noise_png(rng))
+        variant = i * header_variants // max(1, pages)
+        page.insert_text((72, 70), f"Quarterly Report {2020 + variant} - Internal Use Only", fontsize=11)
+        for n in range(8):
+            page.insert_text((72, 110 + 18 * n), " ".join(rng.choice(WORDS) for _ in range(10)), fontsize=10)
+        page.insert_text((200, h - 22), "CONFIDENTIAL WATERMARK", fontsize=10)
+        page.insert_text((w - 120, h - 22), f"Page {i + 1} of {pages}", fontsize=9)
+    doc.save(path, garbage=1, deflate=True)
+    doc.close()
+    return path
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m benchmarks.synthetic", description="Generate a synthetic PDF for benchmarking")
+    p.add_argument("output")
+    p.add_argument("--pages", type=int, default=200)
+    p.add_argument("--logos", type=int, default=1)
+    p.add_argument("--duplicated", action="store_true", help="write each logo as a separate stream on every page")
+    p.add_argument("--header-variants", type=int, default=1)
+    p.add_argument("--mixed-sizes", action="store_true")
+    p.add_argument("--reencoded", action="store_true", help="re-encode and slightly resize the logos on every page")
+    p.add_argument("--images-per-page", type=int, default=0)
+    p.add_argument("--seed", type=int, default=0)
+    return p
+
+if __name__ == "__main__":
+    a = build_parser().parse_args()
+    generate(a.output, a.pages, a.logos, a.duplicated, a.header_variants, a.mixed_sizes, a.images_per_page, a.seed, a.reencoded)
+    print(a.output, file=sys.stderr)
@@ -0,0 +1,86 @@
+# 分析结果磁盘缓存：按文档内容指纹保存逐页扫描结果 (与识别比例无关)，容量超限时按 LRU 淘汰
+import os
+import sys
+import zlib
+import marshal
+import tempfile
+import xxhash
+
+CACHE_VERSION = 2
+CACHE_MAGIC = b"EPC1"
+SAMPLE_BLOCK = 64 * 1024
+SAMPLE_COUNT = 16
+
+def default_cache_dir():
+    base = os.environ.get("PDFCLEAN_CACHE_DIR")
+    if base: return base
+    if sys.platform == "win32":
+        root = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(root, "ExtremePDFCleaner", "analysis")
+
+def fingerprint(file_path):
+    # 快速内容指纹：文件大小 + 头尾块 + 均匀抽样的中间块，大文件也只读取约 1MB
+    size = os.path.getsize(file_path)
+    h = xxhash.xxh64(f"{CACHE_VERSION}:{size}".encode())
+    with open(file_path, "rb") as f:
+        if size <= SAMPLE_BLOCK * (SAMPLE_COUNT + 2):
+            h.update(f.read())
+        else:
+            step = (size - SAMPLE_BLOCK) // (SAMPLE_COUNT + 1)
+            for n in range(SAMPLE_COUNT + 2):
+                f.seek(min(n * step, size - SAMPLE_BLOCK))
+                h.update(f.read(SAMPLE_BLOCK))
+    return h.hexdigest()
+
+class AnalysisCache:
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f: blob = f.read()
+            if blob[:4] != CACHE_MAGIC: return None
+            data = marshal.loads(zlib.decompress(blob[4:]))
+            os.utime(path)  # 记录最近访问，用于 LRU
+            return data
+        except Exception:
+            return None
+
+    def put(self, key, data):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            blob = CACHE_MAGIC + zlib.compress(marshal.dumps(data), 6)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f: f.write(blob)
+            os.replace(tmp, self._path(key))
+            self.evict()
+        except Exception:
+            pass
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".bin"): continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((st.st_mtime, st.st_size, name))
+            except OSError: continue
+        total = sum(e[1] for e in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes: break
+            try: os.remove(os.path.join(self.cache_dir, name)); total -= size
+            except OSError: pass
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir): return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".bin"):
+                try: os.remove(os.path.join(self.cache_dir, name))
+                except OSError: pass
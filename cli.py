@@ -0,0 +1,157 @@
+# Extreme PDF Cleaner 命令行 / 批处理入口（无 GUI）
+# 用法: python -m cli clean in.pdf -o out.pdf --ratio 30 --auto
+#       python -m cli clean ./reports -o ./cleaned --auto --exclude "Page \d+"
+#       python -m cli clean ./inbox -o ./cleaned --auto --templates --save-template
+#       python -m cli analyze in.pdf
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import tracing
+from cache import AnalysisCache
+from templates import TemplateLibrary, make_template, clean_with_template, default_template_dir
+from engine import (analyze, auto_select, clean_parallel, default_workers, save_document, load_rules, make_rules, save_rules,
+                    select_by_rules, expand_aliases, SAVE_PROFILES)
+
+def iter_pdfs(src, dst):
+    # 单文件 -> 单文件 (dst 为 "-" 时写到标准输出)；目录 -> 递归遍历并在输出目录中保持相同结构
+    if os.path.isfile(src):
+        if dst == "-":
+            yield src, dst
+            return
+        if not dst: dst = os.path.join(os.path.dirname(src), f"cleaned_{os.path.basename(src)}")
+        elif os.path.isdir(dst): dst = os.path.join(dst, f"cleaned_{os.path.basename(src)}")
+        yield src, dst
+        return
+    dst = dst or f"{src.rstrip(os.sep)}_cleaned"
+    for root, _, files in os.walk(src):
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                path = os.path.join(root, name)
+                yield path, os.path.join(dst, os.path.relpath(path, src))
+
+def log(text):
+    print(text, file=sys.stderr, flush=True)
+
+def get_cache(args):
+    return None if args.no_cache else AnalysisCache(args.cache_dir)
+
+def cmd_analyze(args, executor):
+    report = {}
+    for path, _ in iter_pdfs(args.input, None):
+        with tracing.span("document", path=path):
+            doc, _, ic, tc = analyze(path, args.ratio / 100.0, executor, log if args.verbose else None, get_cache(args), fast=args.fast, near=args.near_dup)
+        report[path] = {
+            'images': [{'hash': h, **info} for h, info in ic.items()],
+            'texts': [{'text': k[0], 'bbox': k[1], 'size': k[2], **info} for k, info in tc.items()],
+        }
+        doc.close()
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    return 0
+
+def cmd_clean(args, executor):
+    include = [re.compile(p) for p in args.include]
+    exclude = [re.compile(p) for p in args.exclude]
+    rules = load_rules(args.rules) if args.rules else None
+    if not args.auto and not include and not rules:
+        log(">>> Neither --auto, --include nor --rules given: nothing will be removed.")
+    tolerance = args.tolerance or (rules['tolerance'] if rules else 0.0)
+    library = TemplateLibrary(args.templates) if args.templates else None
+    failed = 0; saved = ([], [])
+    for src, dst in iter_pdfs(args.input, args.output):
+        start = time.perf_counter()
+        try:
+            with tracing.span("document", path=src):
+                # 命中模板时跳过分析，直接按模板清理
+                template, score = library.match_file(src) if library is not None else (None, 0.0)
+                if template:
+                    hashes, texts = template['images'], template['texts']
+                    raw = hashes  # 模板保存的已是原始 key
+                    log(f">>> {src}: matched template '{template['name']}' ({score:.0%}), analysis skipped.")
+                    doc, cleaned = clean_with_template(src, template, executor, log=log if args.verbose else None, object_mode=args.object_mode)
+                else:
+                    doc, hasher, ic, tc = analyze(src, args.ratio / 100.0, executor, log if args.verbose else None, get_cache(args), fast=args.fast, near=args.near_dup)
+                    if rules: hashes, texts = select_by_rules(ic, tc, rules, hasher.aliases)
+                    else: hashes, texts = auto_select(ic, tc, args.auto, include, exclude, not args.skip_images, not args.skip_text)
+                    raw = expand_aliases(hashes, hasher.aliases)
+                    if library is not None and args.save_template and (hashes or texts):
+                        # 指纹取自清理前的文档 (少量页面时清理会直接修改 doc)
+                        name = os.path.splitext(os.path.basename(src))[0]
+                        try: log(f">>> Template '{library.add(make_template(doc, hashes, texts, hasher.aliases, name, tolerance))}' saved.")
+                        except ValueError as e: log(f">>> Template not saved: {e}")
+                    cleaned = clean_parallel(src, doc, hasher, hashes, texts, executor, log=log if args.verbose else None, tolerance=tolerance,
+                                             object_mode=args.object_mode)
+                saved[0].extend(h for h in raw if h not in saved[0]); saved[1].extend(t for t in texts if t not in saved[1])
+                if dst == "-":
+                    save_document(cleaned, sys.stdout.buffer, args.profile, log if args.verbose else None)
+                else:
+                    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+                    save_document(cleaned, dst, args.profile, log if args.verbose else None)
+                if cleaned is not doc: cleaned.close()
+                doc.close()
+            log(f"{src} -> {dst}: {len(hashes)} images, {len(texts)} text lines removed ({time.perf_counter() - start:.1f}s)")
+        except Exception as e:
+            failed += 1
+            log(f"Error: {src}: {e}")
+    if args.save_rules:
+        # 记录本次实际生效的选择，供 --rules 与服务模式复用
+        log(f">>> Rules written to {save_rules(args.save_rules, make_rules(*saved, tolerance=tolerance))}")
+    return 1 if failed else 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Extreme PDF Cleaner (headless)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("analyze", "clean"):
+        p = sub.add_parser(name)
+        p.add_argument("input", help="PDF file or directory (searched recursively)")
+        p.add_argument("--ratio", type=int, default=30, choices=range(10, 101), metavar="10-100", help="watermark ratio in percent")
+        p.add_argument("--workers", type=int, default=default_workers())
+        p.add_argument("-v", "--verbose", action="store_true")
+        p.add_argument("--fast", action="store_true", help="sample pages to propose candidates, then only verify them on the rest")
+        p.add_argument("--near-dup", action="store_true", help="also group re-encoded / slightly resized images by perceptual hash (needs numpy)")
+        p.add_argument("--no-cache", action="store_true", help="do not read or write the analysis cache")
+        p.add_argument("--cache-dir", help="analysis cache directory")
+        p.add_argument("--trace", metavar="FILE", help="record phase timings and write a Chrome trace (JSON) to FILE")
+        p.add_argument("--cprofile", metavar="FILE", help="profile the run with cProfile (workers included) and write pstats to FILE")
+        if name == "clean":
+            p.add_argument("-o", "--output", help="output file or directory ('-' writes a single file to stdout)")
+            p.add_argument("--profile", choices=sorted(SAVE_PROFILES), default="standard", help="output profile")
+            p.add_argument("--auto", action="store_true", help="accept every detected candidate")
+            p.add_argument("--include", action="append", default=[], metavar="REGEX", help="accept text candidates matching REGEX")
+            p.add_argument("--exclude", action="append", default=[], metavar="REGEX", help="never remove text candidates matching REGEX")
+            p.add_argument("--skip-images", action="store_true")
+            p.add_argument("--skip-text", action="store_true")
+            p.add_argument("--object-mode", action="store_true", help="remove watermark objects once per xref / content stream instead of per-page redaction")
+            p.add_argument("--tolerance", type=float, default=0.0, help="bbox tolerance (pt) when matching text lines")
+            p.add_argument("--rules", metavar="FILE", help="apply saved selection rules instead of --auto / --include")
+            p.add_argument("--save-rules", metavar="FILE", help="save the applied selection as rules to FILE")
+            p.add_argument("--templates", nargs="?", const=default_template_dir(), metavar="DIR",
+                           help="match files against the template library and skip analysis on a hit (default library if DIR is omitted)")
+            p.add_argument("--save-template", action="store_true", help="with --templates: save each analyzed file's selection as a new template")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "clean" and args.output == "-" and not os.path.isfile(args.input):
+        parser.error("-o - (stdout) needs a single input file")
+    profiling = tracing.profiled(args.cprofile, log) if args.cprofile else contextlib.nullcontext()
+    if args.trace and not args.cprofile: tracing.start()
+    try:
+        # 整个批次共用一个进程池
+        with profiling, ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            return cmd_analyze(args, executor) if args.command == "analyze" else cmd_clean(args, executor)
+    finally:
+        if args.trace or args.cprofile:
+            tracing.stop(); tracing.log_summary(log)
+        if args.trace: log(f">>> Trace written to {tracing.export_chrome(args.trace)}")
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
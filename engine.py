@@ -0,0 +1,1194 @@
+# Extreme PDF Cleaner 核心引擎：水印检测与清理，不依赖 Qt，可被 GUI / CLI 复用
+import os
+import re
+import sys
+import json
+import math
+import fnmatch
+import random
+import time
+import inspect
+import functools
+from array import array
+import xxhash
+import fitz
+import tracing
+from tracing import span
+from cache import fingerprint
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+try:
+    import numpy as np  # 仅近似重复图像检测需要
+except ImportError:
+    np = None
+
+# --- 1. 图像指纹与页面扫描 ---
+# 这些 Filter 解码后像素等价的流，原始字节不同也可能内容相同，需要解码兜底比对
+LOSSLESS_FILTERS = {"null", "/FlateDecode", "/LZWDecode", "/RunLengthDecode", "/ASCIIHexDecode", "/ASCII85Decode"}
+IMAGE_DICT_KEYS = ("Filter", "Width", "Height", "ColorSpace", "BitsPerComponent", "DecodeParms", "Decode", "ImageMask")
+
+class ImageHasher:
+    # 以"原始流 + 图像字典"作为图像 key，每个 xref 在同一文档中只计算一次
+    def __init__(self, doc):
+        self.doc = doc
+        self.keys = {}; self.sigs = {}; self.refs = {}; self.content = {}
+        self.aliases = {}
+        self.thumbs = {}  # 近似重复模式：key -> 缩略图 (无法处理时为 None)，同一进程内每个 key 只解码一次
+
+    def _ref_key(self, value):
+        # 把 "12 0 R" 这类间接引用替换为被引用对象内容的 hash，避免重复流因 xref 不同而失配
+        parts = value.replace("[", " [ ").replace("]", " ] ").split()
+        out = []
+        for i, tok in enumerate(parts):
+            if tok == "R" and i >= 2 and parts[i - 2].isdigit():
+                ref = int(parts[i - 2])
+                if ref not in self.refs:
+                    self.refs[ref] = str(ref)  # 防止循环引用
+                    if self.doc.xref_is_stream(ref): data = self.doc.xref_stream_raw(ref)
+                    else: data = self._ref_key(self.doc.xref_object(ref, compressed=True)).encode()
+                    self.refs[ref] = xxhash.xxh64(data).hexdigest()
+                out[-2:] = [self.refs[ref]]
+            else: out.append(tok)
+        return " ".join(out)
+
+    def signature(self, xref):
+        if xref not in self.sigs:
+            sig = []
+            for k in IMAGE_DICT_KEYS:
+                t, v = self.doc.xref_get_key(xref, k)
+                sig.append(self._ref_key(v) if t in ("xref", "array", "dict") else v)
+            t, v = self.doc.xref_get_key(xref, "SMask")
+            sig.append(self.hash(int(v.split()[0])) if t == "xref" else v)
+            self.sigs[xref] = tuple(sig)
+        return self.sigs[xref]
+
+    def hash(self, xref, aliases=None):
+        # aliases 为本次调用使用的别名表 (默认用 self.aliases)；子进程中常驻的 hasher 被多个任务共用，不能改写 self.aliases
+        h = self.keys.get(xref)
+        if h is None:
+            try:
+                raw = self.doc.xref_stream_raw(xref)
+                if raw is None: raise ValueError("no stream")
+                h = "r" + xxhash.xxh64(repr(self.signature(xref)).encode() + raw).hexdigest()
+            except Exception:
+                pix = fitz.Pixmap(self.doc, xref)
+                h = "p" + xxhash.xxh64(pix.samples).hexdigest()
+            self.keys[xref] = h
+        return (self.aliases if aliases is None else aliases).get(h, h)
+
+    @staticmethod
+    def pixel_sig(sig):
+        # 去掉编码相关字段 (Filter / DecodeParms)，只保留决定像素内容的部分
+        return sig[1:5] + sig[6:]
+
+    def content_hash(self, xref):
+        # 兜底：解码流（不转换为 Pixmap）后比对像素数据
+        if xref not in self.content:
+            sig = self.pixel_sig(self.signature(xref))
+            self.content[xref] = "c" + xxhash.xxh64(repr(sig).encode() + self.doc.xref_stream(xref)).hexdigest()
+        return self.content[xref]
+
+    def resolve_aliases(self, img_sigs):
+        # img_sigs: {原始 key: (sig, xref)}
+        # 仅当多个原始 key 的图像字典一致且为无损编码时才解码，内容相同的 key 合并为同一别名
+        by_sig = {}
+        for h, (sig, xref) in img_sigs.items():
+            if sig and sig[0] in LOSSLESS_FILTERS:
+                by_sig.setdefault(self.pixel_sig(sig), {}).setdefault(h, xref)
+        for keys in by_sig.values():
+            if len(keys) < 2: continue
+            groups = {}
+            for h, xref in keys.items():
+                try: groups.setdefault(self.content_hash(xref), []).append(h)
+                except Exception: continue
+            for c, hs in groups.items():
+                if len(hs) > 1:
+                    for h in hs: self.aliases[h] = c
+        return self.aliases
+
+class CandidateTable:
+    # 紧凑的计数表：文本行 (text, bbox, size_key) 经 xxh64 驻留为整数 id，计数存放在 array 中
+    # 子进程为自己的页面区间各建一张表，主进程边接收边合并；主进程只保留出现 >= 2 次的文本内容，
+    # 因此内存随不同候选的数量增长，而不是随文档总文本量增长
+    def __init__(self, keep_strings=True):
+        self.keep_strings = keep_strings
+        self.sizes = []; self.size_ids = {}; self.pages = array('I')
+        self.ids = {}; self.counts = array('I'); self.first = array('I'); self.group = array('I')
+        self.strings = {}
+        self.imgs = {}; self.img_first = {}; self.img_sigs = {}
+        self.img_pages = {}  # {sid: {key: array 页码}}：合并别名时按页去重，只在扫描期间使用，不写入缓存
+        self.img_phash = {}  # 近似重复模式：{key: (宽高比分桶, 64 位 dHash, 平均 RGB)}
+
+    def size_id(self, size_key):
+        sid = self.size_ids.get(size_key)
+        if sid is None:
+            sid = self.size_ids[size_key] = len(self.sizes)
+            self.sizes.append(size_key); self.pages.append(0)
+        return sid
+
+    def text_id(self, key64, sid, page_index):
+        gid = self.ids.get(key64)
+        if gid is None:
+            gid = self.ids[key64] = len(self.counts)
+            self.counts.append(0); self.first.append(page_index); self.group.append(sid)
+        elif page_index < self.first[gid]: self.first[gid] = page_index
+        return gid
+
+    def add_page(self, page_index, size_key, imgs, texts):
+        # imgs: [(hash, xref, sig)]，texts: [(text, bbox)]
+        sid = self.size_id(size_key); self.pages[sid] += 1
+        group_imgs = self.imgs.setdefault(sid, {})
+        for h, xref, sig in imgs:
+            if h in self.img_sigs and self.img_first[h][0] <= page_index: pass
+            else: self.img_first[h] = (page_index, xref)
+            self.img_sigs.setdefault(h, (sig, xref))
+        group_pages = self.img_pages.setdefault(sid, {})
+        for h in set(h for h, _, _ in imgs):
+            group_imgs[h] = group_imgs.get(h, 0) + 1
+            group_pages.setdefault(h, array('I')).append(page_index)
+        for text, bbox in texts:
+            gid = self.text_id(text_key64(text, bbox, size_key), sid, page_index)
+            self.counts[gid] += 1
+            if self.keep_strings or self.counts[gid] >= 2: self.strings.setdefault(gid, (text, bbox))
+
+    def merge(self, other):
+        sid_map = [self.size_id(s) for s in other.sizes]
+        for osid, n in enumerate(other.pages): self.pages[sid_map[osid]] += n
+        for key64, ogid in other.ids.items():
+            gid = self.text_id(key64, sid_map[other.group[ogid]], other.first[ogid])
+            self.counts[gid] += other.counts[ogid]
+            if (self.keep_strings or self.counts[gid] >= 2) and gid not in self.strings and ogid in other.strings:
+                self.strings[gid] = other.strings[ogid]
+        for osid, group_imgs in other.imgs.items():
+            mine = self.imgs.setdefault(sid_map[osid], {})
+            for h, c in group_imgs.items(): mine[h] = mine.get(h, 0) + c
+        for osid, group_pages in other.img_pages.items():
+            mine = self.img_pages.setdefault(sid_map[osid], {})
+            for h, pages in group_pages.items(): mine.setdefault(h, array('I')).extend(pages)
+        for h, (page_index, xref) in other.img_first.items():
+            if h not in self.img_first or page_index < self.img_first[h][0]: self.img_first[h] = (page_index, xref)
+        for h, v in other.img_sigs.items(): self.img_sigs.setdefault(h, v)
+        for h, v in other.img_phash.items(): self.img_phash.setdefault(h, v)
+        return self
+
+    def add_verified(self, result):
+        # 合并快速模式验证阶段的计数 (只包含候选)
+        for size_key, n in result['pages'].items(): self.pages[self.size_id(size_key)] += n
+        for (size_key, h), c in result['imgs'].items():
+            group_imgs = self.imgs.setdefault(self.size_id(size_key), {})
+            group_imgs[h] = group_imgs.get(h, 0) + c
+        for key64, c in result['texts'].items():
+            gid = self.ids.get(key64)
+            if gid is not None: self.counts[gid] += c
+
+    def apply_aliases(self, aliases):
+        # 同一页上的多个原始 key 合并为同一别名时只计一次：合并组的计数为各 key 页码集合并集的大小
+        if not aliases: return
+        for sid, group_imgs in self.imgs.items():
+            group_pages = self.img_pages.get(sid, {})
+            groups = {}
+            for h in group_imgs: groups.setdefault(aliases.get(h, h), []).append(h)
+            merged = {}; merged_pages = {}
+            for a, keys in groups.items():
+                if len(keys) == 1 or not all(h in group_pages for h in keys):
+                    merged[a] = min(self.pages[sid], sum(group_imgs[h] for h in keys))
+                    if len(keys) == 1 and keys[0] in group_pages: merged_pages[a] = group_pages[keys[0]]
+                    continue
+                pages = sorted(set().union(*(group_pages[h] for h in keys)))
+                merged[a] = len(pages); merged_pages[a] = array('I', pages)
+            self.imgs[sid] = merged; self.img_pages[sid] = merged_pages
+        first = {}
+        for h, v in self.img_first.items():
+            a = aliases.get(h, h)
+            if a not in first or v[0] < first[a][0]: first[a] = v
+        self.img_first = first
+
+    def total_pages(self):
+        return sum(self.pages)
+
+    def to_dict(self):
+        # 供磁盘缓存使用 (marshal 可序列化)
+        return {'sizes': self.sizes, 'pages': self.pages.tobytes(), 'counts': self.counts.tobytes(),
+                'first': self.first.tobytes(), 'group': self.group.tobytes(),
+                'strings': self.strings, 'imgs': self.imgs, 'img_first': self.img_first}
+
+    @classmethod
+    def from_dict(cls, data):
+        table = cls(keep_strings=False)
+        table.sizes = [tuple(s) for s in data['sizes']]
+        table.size_ids = {s: i for i, s in enumerate(table.sizes)}
+        for name in ('pages', 'counts', 'first', 'group'): getattr(table, name).frombytes(data[name])
+        table.strings = data['strings']; table.imgs = data['imgs']; table.img_first = data['img_first']
+        return table
+
+def text_key64(text, bbox, size_key):
+    return xxhash.xxh64(f"{text}\x00{bbox}\x00{size_key}".encode()).intdigest()
+
+def peak_rss_mb():
+    # 当前进程的峰值常驻内存 (MB)，无法获取时返回 None
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS(); counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize / (1024 * 1024)
+    except Exception:
+        pass
+    return None
+
+class Cancelled(Exception):
+    pass
+
+WARM_DOC_LIMIT = 2  # 每个子进程最多常驻打开的文档数
+_warm_docs = {}
+
+# --- 1.1 近似重复图像 (感知哈希) ---
+# 重新编码 / 轻微缩放过的 logo 原始流不同，精确指纹无法合并；这里为每个不同的图像 key 计算 64 位 dHash，
+# 宽高比、平均颜色相近且汉明距离 <= NEAR_DISTANCE 的 key 视为同一图像 (dHash 只反映明暗结构，
+# 形状相同、颜色不同的 logo 靠平均颜色区分)。分组用多索引哈希 (按位分段分桶，
+# 由鸽巢原理，距离 <= d 的两个哈希至少有一段完全相同)，只在同桶内做向量化比较，避免 O(n²)
+NEAR_DISTANCE = 6
+NEAR_MEAN_DELTA = 12  # 平均颜色每个通道 (0-255) 允许的差值
+NEAR_ASPECT_DELTA = 15  # 宽高比 log2 (x100) 允许的差值，约 ±10%
+NEAR_MAX_PIXELS = 1 << 20  # 超过该像素数的图像不完整解码，改为按显示区域低分辨率渲染
+
+def image_thumbnail(doc, page, xref):
+    # 8x9 灰度均值缩略图，返回 (宽高比 log2 x100, 缩略图, 平均 RGB)；无法处理的图像返回 None
+    w = int(doc.xref_get_key(xref, "Width")[1] or 0); h = int(doc.xref_get_key(xref, "Height")[1] or 0)
+    if w < 4 or h < 4: return None
+    if w * h <= NEAR_MAX_PIXELS:
+        pix = fitz.Pixmap(doc, xref)
+        if pix.alpha: pix = fitz.Pixmap(pix, 0)
+        k = 0
+        while min(pix.width, pix.height) >> (k + 1) >= 16: k += 1
+        if k: pix.shrink(k)
+        if pix.n != 3: pix = fitz.Pixmap(fitz.csRGB, pix)
+    else:
+        rects = page.get_image_rects(xref)
+        if not rects or rects[0].is_empty: return None
+        r = rects[0]
+        pix = page.get_pixmap(matrix=fitz.Matrix(32 / r.width, 32 / r.height), clip=r, colorspace=fitz.csRGB)
+    rgb = np.frombuffer(pix.samples, np.uint8)[:pix.height * pix.width * 3].reshape(pix.height, pix.width, 3).astype(np.float32)
+    a = rgb @ np.array([0.299, 0.587, 0.114], np.float32)
+    ph, pw = a.shape
+    if ph < 8 or pw < 9:
+        a = np.repeat(np.repeat(a, -(-8 // ph), 0), -(-9 // pw), 1); ph, pw = a.shape
+    rows = np.arange(8) * ph // 8; cols = np.arange(9) * pw // 9
+    total = np.add.reduceat(np.add.reduceat(a, rows, 0), cols, 1)
+    area = np.diff(np.r_[rows, ph])[:, None] * np.diff(np.r_[cols, pw])[None, :]
+    return round(100 * math.log2(w / h)), total / area, rgb.mean(axis=(0, 1))
+
+def perceptual_hashes(thumbs):
+    # thumbs: {key: (宽高比, 8x9 缩略图, 平均 RGB)} -> {key: (宽高比, dHash, 平均 RGB)}，整批向量化计算
+    # dHash 为相邻像素的亮度梯度符号；差值小于对比度 3% 的视为持平 (记 0)，避免平坦区域的压缩噪声翻转比特
+    # 几乎没有明暗变化的平坦图像 dHash 无区分度，不参与近似匹配
+    keys = list(thumbs)
+    t = np.stack([thumbs[k][1] for k in keys])
+    contrast = t.max(axis=(1, 2)) - t.min(axis=(1, 2))
+    eps = np.maximum(2, contrast * 0.03)[:, None, None]
+    bits = np.packbits((t[:, :, 1:] - t[:, :, :-1] > eps).reshape(len(keys), 64), axis=1).view(">u8").ravel()
+    flat = contrast < 8
+    return {k: (thumbs[k][0], int(v), tuple(int(c) for c in thumbs[k][2])) for k, v, f in zip(keys, bits, flat) if not f}
+
+def popcount64(a):
+    if hasattr(np, "bitwise_count"): return np.bitwise_count(a)
+    table = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+    return table[a.view(np.uint8)].reshape(a.shape + (8,)).sum(-1)
+
+def connected_labels(n, first, second):
+    # 向量化连通分量：沿边反复取最小标签 + 指针跳跃，直到收敛
+    labels = np.arange(n)
+    while len(first):
+        low = np.minimum(labels[first], labels[second])
+        new = labels.copy(); np.minimum.at(new, first, low); np.minimum.at(new, second, low)
+        new = new[new]
+        if np.array_equal(new, labels): break
+        labels = new
+    return labels
+
+def near_duplicate_groups(phashes, max_distance=NEAR_DISTANCE, block=1024):
+    # phashes: {key: (宽高比, dHash, 平均 RGB)} -> [[key, ...], ...] (只返回含 2 个以上 key 的组)
+    items = list(phashes.items())
+    if len(items) < 2: return []
+    # 特征完全相同的先合并，只对不同的特征行聚类
+    rows, inverse = np.unique(np.array([(v,) + rgb + (aspect + 10000,) for _, (aspect, v, rgb) in items], dtype=np.uint64),
+                              axis=0, return_inverse=True)
+    uniq = rows[:, 0]; means = rows[:, 1:4].astype(np.int64); aspects = rows[:, 4].astype(np.int64)
+    bands = max_distance + 1
+    bounds = [64 * b // bands for b in range(bands + 1)]
+    masks = [np.uint64(((1 << (bounds[b + 1] - bounds[b])) - 1) << bounds[b]) for b in range(bands)]
+    first = []; second = []
+    for b in range(bands):
+        band = uniq & masks[b]
+        order = np.argsort(band, kind="stable"); sb = band[order]
+        starts = np.flatnonzero(np.r_[True, sb[1:] != sb[:-1]]); ends = np.r_[starts[1:], len(sb)]
+        for s, e in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            idx = order[s:e]
+            for lo in range(0, len(idx), block):
+                part = idx[lo:lo + block]; rest = idx[lo:]
+                close = popcount64(uniq[part][:, None] ^ uniq[rest][None, :]) <= max_distance
+                i, j = np.nonzero(close & (np.arange(len(rest))[None, :] > np.arange(len(part))[:, None]))
+                a, c = part[i], rest[j]
+                # 同一对可能在多个分段同桶，只在第一个相同的分段处理；再检查颜色和宽高比
+                x = uniq[a] ^ uniq[c]
+                keep = (np.abs(means[a] - means[c]).max(axis=1) <= NEAR_MEAN_DELTA) & (np.abs(aspects[a] - aspects[c]) <= NEAR_ASPECT_DELTA)
+                for m in masks[:b]: keep &= (x & m) != 0
+                first.append(a[keep]); second.append(c[keep])
+    if not first: return []
+    labels = connected_labels(len(uniq), np.concatenate(first), np.concatenate(second))[inverse.ravel()]
+    members = {}
+    for (k, _), label in zip(items, labels.tolist()): members.setdefault(label, []).append(k)
+    return [g for g in members.values() if len(g) > 1]
+
+def resolve_near_duplicates(hasher, phashes, max_distance=NEAR_DISTANCE):
+    # 每组 key 映射到同一个别名；已有的精确别名 (解码比对) 一并改指向新别名
+    groups = near_duplicate_groups(phashes, max_distance)
+    remap = {}
+    for keys in groups:
+        alias = "n" + xxhash.xxh64("".join(sorted(keys)).encode()).hexdigest()
+        for h in keys:
+            remap[hasher.aliases.get(h, h)] = alias; hasher.aliases[h] = alias
+    for h, a in list(hasher.aliases.items()):
+        if a in remap: hasher.aliases[h] = remap[a]
+    return groups
+
+def warm_document(file_path):
+    # 子进程内常驻打开的文档 (连同其 ImageHasher 缓存)，同一文件的后续批次直接复用；
+    # WARM_DOC_LIMIT 为 0 时不常驻，文档随批次结束释放
+    st = os.stat(file_path)
+    key = (os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
+    entry = _warm_docs.pop(key, None)
+    if entry is None:
+        while _warm_docs and len(_warm_docs) >= WARM_DOC_LIMIT:
+            old = next(iter(_warm_docs))
+            _warm_docs.pop(old)[0].close()
+        doc = fitz.open(file_path)
+        entry = (doc, ImageHasher(doc))
+    if WARM_DOC_LIMIT: _warm_docs[key] = entry  # 重新插入到末尾，保持 LRU 顺序
+    return entry
+
+def disable_warm_documents():
+    # 进程池 initializer：服务模式处理完的输入文件要移走，子进程不能一直打开着它 (Windows 上移动会失败)
+    global WARM_DOC_LIMIT
+    WARM_DOC_LIMIT = 0
+
+def text_lines(blocks):
+    # 文本行统计规则：行内各 span 拼接后去掉首尾空白，长度 > 1 才计入，bbox 保留 1 位小数
+    texts = []
+    for b in blocks:
+        if b["type"] != 0: continue
+        for line in b["lines"]:
+            content = "".join([span["text"] for span in line["spans"]]).strip()
+            if len(content) > 1: texts.append((content, tuple([round(v, 1) for v in line["bbox"]])))
+    return texts
+
+def analyze_chunk_worker(file_path, page_indices, near=False):
+    table = CandidateTable(); thumbs = {}
+    try:
+        with span("chunk.open"): doc, hasher = warm_document(file_path)
+        for i in page_indices:
+            page = doc[i]
+            rect = page.rect
+            pw, ph = round(rect.width, 1), round(rect.height, 1)
+            imgs = []
+            with span("scan.images", page=i):
+                for img in page.get_images():
+                    try:
+                        h = hasher.hash(img[0])
+                        imgs.append((h, img[0], hasher.sigs.get(img[0])))
+                    except: continue
+                    if near and h not in thumbs:
+                        if h not in hasher.thumbs:
+                            with span("scan.thumbnail", page=i):
+                                try: hasher.thumbs[h] = image_thumbnail(doc, page, img[0])
+                                except Exception: hasher.thumbs[h] = None
+                        if hasher.thumbs[h] is not None: thumbs[h] = hasher.thumbs[h]
+            with span("scan.text", page=i): blocks = page.get_text("dict")["blocks"]
+            texts = text_lines(blocks)
+            table.add_page(i, (pw, ph), imgs, texts)
+        if thumbs: table.img_phash = perceptual_hashes(thumbs)
+    except: pass
+    return table
+
+# --- 2. 候选统计 ---
+def default_workers():
+    return max(1, (os.cpu_count() or 4) - 1)
+
+def batch_ranges(pages, workers):
+    # 小批次动态分发：批次数约为进程数的 8 倍，单批 1~32 页
+    size = max(1, min(32, len(pages) // max(1, workers * 8)))
+    return [pages[i:i + size] for i in range(0, len(pages), size)]
+
+def run_batches(executor, fn, batches, args=(), on_result=None, cancel=None, in_flight=None):
+    # 限制在途批次数量，完成一个补一个；按完成顺序处理结果，并在每轮检查取消标志
+    pending = {}; it = iter(batches)
+    in_flight = in_flight or default_workers() * 2
+    def submit():
+        for batch in it:
+            pending[tracing.submit(executor, fn, *args, batch)] = batch
+            if len(pending) >= in_flight: return
+    submit()
+    try:
+        while pending:
+            if cancel is not None and cancel.is_set(): raise Cancelled()
+            done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            for f in done:
+                batch = pending.pop(f)
+                result = tracing.result(f)
+                if on_result: on_result(batch, result)
+            submit()
+    finally:
+        for f in pending: f.cancel()
+
+class ScanProgress:
+    # 按页累计进度，日志每 10% 输出一次
+    def __init__(self, total, log=None, progress=None):
+        self.total = max(1, total); self.done = 0; self.logged = 0
+        self.log = log; self.progress = progress
+
+    def advance(self, pages):
+        self.done += pages
+        pct = int(self.done / self.total * 100)
+        if self.progress: self.progress(pct)
+        if self.log and pct >= self.logged + 10:
+            self.logged = pct - pct % 10
+            self.log(f">>> Scanning progress: {pct}%")
+
+def scan_document(file_path, pages, executor=None, log=None, progress=None, cancel=None, reporter=None, near=False):
+    # 子进程结果到达即合并进总表，不保留逐页数据
+    workers = default_workers()
+    own = executor is None
+    if own: executor = ProcessPoolExecutor(max_workers=workers)
+    table = CandidateTable(keep_strings=False)
+    reporter = reporter or ScanProgress(len(pages), log, progress)
+    def on_result(batch, chunk_table):
+        table.merge(chunk_table)
+        reporter.advance(len(batch))
+    try:
+        worker = functools.partial(analyze_chunk_worker, near=True) if near else analyze_chunk_worker
+        run_batches(executor, worker, batch_ranges(pages, workers), (file_path,), on_result, cancel)
+    finally:
+        if own: executor.shutdown(cancel_futures=True)
+    return table
+
+# --- 快速模式：抽样提名 + 定向验证 ---
+SAMPLE_ALPHA = 0.001  # 频率达到阈值的候选在样本中被漏掉的概率上限
+
+def sample_size(group_count, ratio_threshold, alpha=SAMPLE_ALPHA):
+    # Chernoff 界：频率 >= ratio 的元素，在 n 页样本中出现次数低于期望一半的概率 <= exp(-n*ratio/8)
+    n = math.ceil(8 * math.log(1 / alpha) / max(ratio_threshold, 0.01))
+    return min(group_count, n)
+
+def page_size_groups(doc):
+    groups = {}
+    for i in range(len(doc)):
+        rect = doc[i].rect
+        groups.setdefault((round(rect.width, 1), round(rect.height, 1)), []).append(i)
+    return groups
+
+def text_needles(text):
+    # 候选文本作为一个完整字符串在内容流中的单字节编码形式：带括号的字面量 (转义括号与反斜杠) 与大小写两种十六进制串；
+    # 无法按单字节编码时返回 None，表示验证时必须提取文本
+    try: raw = text.encode("cp1252")
+    except UnicodeEncodeError: return None
+    literal = raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+    return (b"(" + literal + b")", b"<" + raw.hex().encode() + b">", b"<" + raw.hex().upper().encode() + b">")
+
+def page_image_xrefs(doc, page, kinds):
+    # 只读页面资源中的 XObject 字典取图像 xref，不走 get_images；kinds 缓存各 xref 的 Subtype
+    # 资源继承自父节点或引用了表单 XObject (其中可能嵌套图像) 时退回 get_images，与完整扫描一致
+    t, v = doc.xref_get_key(page.xref, "Resources/XObject")
+    if t == "dict" or (t == "null" and doc.xref_get_key(page.xref, "Resources")[0] != "null"):
+        xrefs = [int(x) for x in re.findall(r"(\d+) \d+ R", v)] if t == "dict" else []
+        for x in xrefs:
+            if x not in kinds: kinds[x] = doc.xref_get_key(x, "Subtype")[1]
+        if all(kinds[x] == "/Image" for x in xrefs): return xrefs
+    return [img[0] for img in page.get_images()]
+
+VERIFY_TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+def verify_lines(page, texts):
+    # text_lines 结果中文本属于 texts 的那些行，但只在 C 层取块与单词，不构造逐行的 dict：
+    # 单行块的文本与 bbox 即该行的；多行块中文本等于候选的行，bbox 为该行各单词 bbox 的并集
+    tp = page.get_textpage(flags=VERIFY_TEXT_FLAGS)
+    lines = []; words = None
+    for x0, y0, x1, y1, text, block_no, kind in tp.extractBLOCKS():
+        if kind != 0: continue
+        rows = text.split("\n")[:-1]
+        if len(rows) == 1:
+            content = rows[0].strip()
+            if content in texts: lines.append((content, tuple([round(v, 1) for v in (x0, y0, x1, y1)])))
+            continue
+        for line_no, row in enumerate(rows):
+            if row.strip() not in texts: continue
+            if words is None: words = tp.extractWORDS()
+            ws = [w for w in words if w[5] == block_no and w[6] == line_no]
+            # 行首尾的空白、或各单词高度不一 (空格可能来自更高的字体) 时单词并集不等于行 bbox
+            if row != row.strip() or len({(w[1], w[3]) for w in ws}) != 1: return text_lines(page.get_text("dict", textpage=tp)["blocks"])
+            rect = fitz.Rect()
+            for w in ws: rect |= w[:4]
+            lines.append((row, tuple([round(v, 1) for v in rect])))
+    return lines
+
+def verify_chunk_worker(file_path, proposals, aliases, page_indices):
+    # proposals: {size_key: (图像 key 集合, [(key64, text, bbox, needles)])}
+    # 廉价检查：图像只看页面资源里的 xref (原始流指纹按 xref 缓存)；文本先在内容流中查找候选的编码字节，
+    # 只有命中的页面才提取文本，并按与完整扫描相同的规则 (精确文本 + 取整 bbox) 计数
+    result = {'pages': {}, 'imgs': {}, 'texts': {}}
+    try:
+        with span("chunk.open"): doc, hasher = warm_document(file_path)
+        kinds = {}
+        for i in page_indices:
+            page = doc[i]
+            size_key = (round(page.rect.width, 1), round(page.rect.height, 1))
+            result['pages'][size_key] = result['pages'].get(size_key, 0) + 1
+            if size_key not in proposals: continue
+            img_keys, texts = proposals[size_key]
+            if img_keys:
+                found = set()
+                for xref in page_image_xrefs(doc, page, kinds):
+                    try: h = hasher.hash(xref, aliases)
+                    except Exception: continue
+                    if h in img_keys: found.add(h)
+                for h in found: result['imgs'][(size_key, h)] = result['imgs'].get((size_key, h), 0) + 1
+            if texts:
+                # 有候选必须提取文本时不再读内容流
+                if any(needles is None for _, _, _, needles in texts): hit = [(key64, text) for key64, text, _, _ in texts]
+                else:
+                    with span("verify.content", page=i): content = page.read_contents()
+                    hit = [(key64, text) for key64, text, _, needles in texts if any(n in content for n in needles)]
+                if not hit: continue
+                with span("verify.text", page=i): lines = verify_lines(page, {text for _, text in hit})
+                wanted = {key64 for key64, _ in hit}
+                for text, bbox in lines:
+                    key64 = text_key64(text, bbox, size_key)
+                    if key64 in wanted: result['texts'][key64] = result['texts'].get(key64, 0) + 1
+    except Exception: pass
+    return result
+
+def sampled_scan(file_path, doc, hasher, ratio_threshold, executor=None, log=None, progress=None, cancel=None):
+    # 每个页面尺寸组只完整扫描一个统计样本来提名候选，其余页面只验证这些候选
+    groups = page_size_groups(doc)
+    rng = random.Random(len(doc))
+    sample, rest = [], []
+    for size_key, pages in groups.items():
+        n = sample_size(len(pages), ratio_threshold)
+        picked = set(rng.sample(pages, n)) if n < len(pages) else set(pages)
+        sample.extend(p for p in pages if p in picked); rest.extend(p for p in pages if p not in picked)
+    sample.sort(); rest.sort()
+    if log: log(f">>> Fast mode: scanning {len(sample)} sampled pages, verifying {len(rest)} pages.")
+
+    workers = default_workers()
+    own = executor is None
+    if own: executor = ProcessPoolExecutor(max_workers=workers)
+    reporter = ScanProgress(len(sample) + len(rest), log, progress)
+    try:
+        table = scan_document(file_path, sample, executor, cancel=cancel, reporter=reporter)
+        hasher.resolve_aliases(table.img_sigs)
+        table.apply_aliases(hasher.aliases)
+        if not rest: return table
+
+        # 样本中出现次数达到期望一半的元素作为候选
+        proposals = {}
+        for sid, size_key in enumerate(table.sizes):
+            min_hits = max(2, table.pages[sid] * ratio_threshold / 2)
+            imgs = frozenset(h for h, c in table.imgs.get(sid, {}).items() if c >= min_hits)
+            proposals[size_key] = (imgs, [])
+        contents = {}
+        for key64, gid in table.ids.items():
+            size_key = table.sizes[table.group[gid]]
+            if table.counts[gid] >= max(2, table.pages[table.group[gid]] * ratio_threshold / 2) and gid in table.strings:
+                text, bbox = table.strings[gid]
+                # 在样本中首次出现的页面上校验编码形式：内容流里找不到 (TJ 字距拆分、多 span、CID 字体等) 时验证阶段总是提取文本；
+                # 样本中几乎每页都有的候选同样直接提取，逐页读内容流几乎跳过不了任何页面
+                needles = text_needles(text) if table.counts[gid] < 0.9 * table.pages[table.group[gid]] else None
+                if needles is not None:
+                    page_index = table.first[gid]
+                    if page_index not in contents: contents[page_index] = doc[page_index].read_contents()
+                    if not any(n in contents[page_index] for n in needles): needles = None
+                proposals[size_key][1].append((key64, text, bbox, needles))
+        proposals = {k: v for k, v in proposals.items() if v[0] or v[1]}
+
+        def on_result(batch, result):
+            table.add_verified(result)
+            reporter.advance(len(batch))
+        run_batches(executor, verify_chunk_worker, batch_ranges(rest, workers), (file_path, proposals, hasher.aliases), on_result, cancel)
+    finally:
+        if own: executor.shutdown(cancel_futures=True)
+    return table
+
+def aggregate(doc, table, ratio_threshold):
+    final_img_candidates = {}; final_txt_candidates = {}
+    thresholds = [max(2, n * ratio_threshold) for n in table.pages]
+    for sid, group_imgs in table.imgs.items():
+        for h, count in group_imgs.items():
+            if count < thresholds[sid]: continue
+            if h not in final_img_candidates:
+                page_index, xref = table.img_first[h]
+                with span("image_rects", page=page_index): img_rect = doc[page_index].get_image_rects(xref)[0]
+                final_img_candidates[h] = {'xref': xref, 'count': 0, 'sample_page': page_index, 'sample_bbox': tuple(img_rect)}
+            final_img_candidates[h]['count'] += count
+    for gid, count in enumerate(table.counts):
+        sid = table.group[gid]
+        if count >= thresholds[sid] and gid in table.strings:
+            text, bbox = table.strings[gid]
+            final_txt_candidates[(text, tuple(bbox), table.sizes[sid])] = {'sample_page': table.first[gid], 'count': count}
+    return final_img_candidates, final_txt_candidates
+
+def log_peak_memory(log, stage):
+    peak = peak_rss_mb()
+    if log and peak is not None: log(f">>> Peak memory after {stage}: {peak:.0f} MB")
+
+def analyze(file_path, ratio_threshold=0.3, executor=None, log=None, cache=None, progress=None, cancel=None, fast=False, near=False):
+    # 返回 (doc, hasher, 图像候选, 文本候选)，doc 保持打开供后续清理使用
+    # cache 为 AnalysisCache 时复用同一文档的扫描结果，只重新做统计
+    # cancel 为 threading.Event 之类带 is_set() 的对象，置位后抛出 Cancelled
+    # fast 为 True 时使用抽样提名 + 定向验证 (结果与比例相关，不写入缓存)
+    # near 为 True 时额外按感知哈希合并近似重复的图像 (需要 numpy，完整扫描且不使用缓存)
+    if log: log(">>> Starting analysis...")
+    if near and np is None:
+        if log: log(">>> numpy is not installed: near-duplicate image detection disabled.")
+        near = False
+    if near: cache = None
+    doc = fitz.open(file_path)
+    total = len(doc)
+    hasher = ImageHasher(doc)
+    key = fingerprint(file_path) if cache is not None else None
+    with span("cache.lookup"):
+        cached = cache.get(key) if key else None
+        table = CandidateTable.from_dict(cached['table']) if cached else None
+    if table is not None and table.total_pages() == total:
+        hasher.aliases = cached['aliases']
+        if log: log(f">>> PDF loaded: {total} pages. Reusing cached scan results.")
+    elif fast and not near:
+        if log: log(f">>> PDF loaded: {total} pages. Using {default_workers()} CPU cores.")
+        try:
+            with span("scan", pages=total, fast=True): table = sampled_scan(file_path, doc, hasher, ratio_threshold, executor, log, progress, cancel)
+        except Cancelled:
+            doc.close(); raise
+    else:
+        if log: log(f">>> PDF loaded: {total} pages. Using {default_workers()} CPU cores.")
+        try:
+            with span("scan", pages=total): table = scan_document(file_path, range(total), executor, log, progress, cancel, near=near)
+        except Cancelled:
+            doc.close(); raise
+        if hasher.resolve_aliases(table.img_sigs) and log:
+            log(f">>> Merged {len(hasher.aliases)} re-encoded image streams by content.")
+        if near:
+            with span("near_duplicates", images=len(table.img_phash)): groups = resolve_near_duplicates(hasher, table.img_phash)
+            if groups and log: log(f">>> Grouped {sum(len(g) for g in groups)} near-duplicate images into {len(groups)} groups.")
+        table.apply_aliases(hasher.aliases)
+        if key: cache.put(key, {'table': table.to_dict(), 'aliases': hasher.aliases})
+    log_peak_memory(log, "scan")
+    with span("aggregate"): img_candidates, txt_candidates = aggregate(doc, table, ratio_threshold)
+    if log: log(f">>> {len(table.counts)} distinct text lines, {len(table.strings)} repeated.")
+    return doc, hasher, img_candidates, txt_candidates
+
+# --- 3. 自动确认规则 (替代交互对话框) ---
+def auto_select(img_candidates, txt_candidates, accept_all=True, include=(), exclude=(), images=True, texts=True):
+    # include / exclude 为已编译的正则；accept_all 时接受全部候选，否则只接受 include 命中的文本
+    hashes = list(img_candidates) if images and accept_all else []
+    selected = []
+    if texts:
+        for text, bbox, size in txt_candidates:
+            if any(p.search(text) for p in exclude): continue
+            if accept_all or any(p.search(text) for p in include):
+                selected.append({'text': text, 'bbox': bbox, 'size': size})
+    return hashes, selected
+
+# 保存的选择规则 (JSON)：上一次确认的图像 hash 与文本 key，可附加 include / exclude 正则、auto 与文本位置容差；
+# match 为文件名通配符列表，服务模式据此为输入文件挑选规则 (为空表示适用于任何文件)
+RULES_VERSION = 1
+
+def make_rules(confirmed_hashes, confirmed_texts, name="", match=(), include=(), exclude=(), accept_all=False, tolerance=0.0):
+    return {'version': RULES_VERSION, 'name': name, 'match': list(match), 'images': list(confirmed_hashes),
+            'texts': [{'text': t['text'], 'bbox': list(t['bbox']), 'size': list(t['size'])} for t in confirmed_texts],
+            'include': list(include), 'exclude': list(exclude), 'auto': accept_all, 'tolerance': tolerance}
+
+def expand_aliases(hashes, aliases=None):
+    # 确认的合并 key (c… / n…) 只在本文档的别名表下有意义，保存前展开为各自的原始 key (合并 key 本身保留在前)
+    # 之后的文档即使只有其中一种编码、不经合并也能命中
+    confirmed = set(hashes)
+    return list(hashes) + sorted(h for h, a in (aliases or {}).items() if a in confirmed and h not in confirmed)
+
+def save_rules(path, rules):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(rules, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+def load_rules(path):
+    with open(path, encoding="utf-8") as f: data = json.load(f)
+    if data.get('version') != RULES_VERSION: raise ValueError(f"unsupported rules version in {path}")
+    rules = make_rules(data.get('images', ()), data.get('texts', ()), data.get('name') or os.path.splitext(os.path.basename(path))[0],
+                       data.get('match', ()), data.get('include', ()), data.get('exclude', ()), data.get('auto', False), data.get('tolerance', 0.0))
+    rules['texts'] = [{'text': t['text'], 'bbox': tuple(t['bbox']), 'size': tuple(t['size'])} for t in rules['texts']]
+    if 'fingerprint' in data: rules['fingerprint'] = data['fingerprint']  # 模板库 (templates.py) 附带的文档指纹
+    return rules
+
+def rules_match(rules, file_path):
+    patterns = rules.get('match') or ()
+    return not patterns or any(fnmatch.fnmatch(os.path.basename(file_path), p) for p in patterns)
+
+def select_by_rules(img_candidates, txt_candidates, rules, aliases=None):
+    # 保存的图像 / 文本直接生效 (不要求在本文档中达到比例阈值)；auto / include 从本文档候选中补充，exclude 优先
+    # aliases 为本文档的 ImageHasher.aliases，保存的原始 key 若在本文档被合并，需映射到合并后的 key
+    aliases = aliases or {}
+    include = [re.compile(p) for p in rules['include']]; exclude = [re.compile(p) for p in rules['exclude']]
+    hashes, texts = auto_select(img_candidates, txt_candidates, rules['auto'], include, exclude)
+    hashes = list(dict.fromkeys(hashes + [aliases.get(h, h) for h in rules['images']]))
+    seen = set((t['text'], tuple(t['bbox']), tuple(t['size'])) for t in texts)
+    for t in rules['texts']:
+        key = (t['text'], tuple(t['bbox']), tuple(t['size']))
+        if key in seen or any(p.search(t['text']) for p in exclude): continue
+        seen.add(key); texts.append({'text': key[0], 'bbox': key[1], 'size': key[2]})
+    return hashes, texts
+
+# --- 4. 清理 ---
+PARALLEL_CLEAN_MIN_PAGES = 40  # 页数太少时分发到进程池的开销大于收益
+
+class TextMatcher:
+    # 已确认文本行的查找结构：(text, bbox, size) 精确哈希 + 按页面尺寸划分的网格索引做容差匹配
+    def __init__(self, confirmed_texts, tolerance=0.0):
+        self.tolerance = tolerance
+        self.exact = set(); self.texts = set(); self.grid = {}
+        self.cell = max(20.0, tolerance * 4)
+        self.hits = self.misses = 0
+        for conf in confirmed_texts:
+            text, bbox, size = conf['text'], tuple(conf['bbox']), tuple(conf['size'])
+            self.exact.add((text, bbox, size)); self.texts.add(text)
+            if tolerance > 0:
+                self.grid.setdefault((size, self._cell(bbox[0]), self._cell(bbox[1])), []).append((text, bbox))
+
+    def __len__(self):
+        return len(self.exact)
+
+    def _cell(self, v):
+        return int(v // self.cell)
+
+    def _near(self, text, bbox, size):
+        tol = self.tolerance
+        for cx in range(self._cell(bbox[0] - tol), self._cell(bbox[0] + tol) + 1):
+            for cy in range(self._cell(bbox[1] - tol), self._cell(bbox[1] + tol) + 1):
+                for t, b in self.grid.get((size, cx, cy), ()):
+                    if t == text and all(abs(u - v) <= tol for u, v in zip(b, bbox)): return (t, b, size)
+        return None
+
+    def lookup(self, text, bbox, size):
+        # 返回命中的已确认 key (text, bbox, size)，未命中返回 None
+        key = None
+        if text in self.texts:
+            key = (text, bbox, size)
+            if key not in self.exact: key = self._near(text, bbox, size) if self.tolerance > 0 else None
+        if key is not None: self.hits += 1
+        else: self.misses += 1
+        return key
+
+    def match(self, text, bbox, size):
+        return self.lookup(text, bbox, size) is not None
+
+def clean_pages(doc, hasher, confirmed_hashes, matcher, page_indices, on_page=None):
+    deleted = set()  # delete_image 作用于整个 xref，共享图像只需替换一次
+    for i in page_indices:
+        page = doc[i]; pw, ph = round(page.rect.width, 1), round(page.rect.height, 1); cur_size = (pw, ph)
+        with span("clean.images", page=i):
+            for img in page.get_images():
+                if img[0] in deleted: continue
+                try: h = hasher.hash(img[0])
+                except Exception: continue
+                if h in confirmed_hashes: page.delete_image(img[0]); deleted.add(img[0])
+        redacted = False
+        if len(matcher):
+            with span("clean.text", page=i): p_dict = page.get_text("dict")
+            for b in p_dict["blocks"]:
+                if b["type"] != 0: continue
+                for line in b["lines"]:
+                    txt = "".join([s["text"] for s in line["spans"]]).strip()
+                    bbox = tuple([round(v, 1) for v in line["bbox"]])
+                    if matcher.match(txt, bbox, cur_size): page.add_redact_annot(line["bbox"]); redacted = True
+        # 没有命中的页面不调用 apply_redactions，避免无谓地重写内容流
+        if redacted:
+            with span("clean.redact", page=i): page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE)
+        if on_page: on_page(i)
+
+def log_match_stats(log, hits, misses):
+    if log and hits + misses: log(f">>> Text lookups: {hits} hits, {misses} misses.")
+
+def clean_document(doc, hasher, confirmed_hashes, confirmed_texts, progress=None, tolerance=0.0, log=None, cancel=None, pages=None):
+    # pages 为要处理的页码 (默认全部页面)
+    pages = range(len(doc)) if pages is None else pages
+    total = max(1, len(pages)); done = [0]
+    def on_page(_):
+        if cancel is not None and cancel.is_set(): raise Cancelled()
+        done[0] += 1
+        if progress: progress(int(done[0] / total * 100))
+    matcher = TextMatcher(confirmed_texts, tolerance)
+    clean_pages(doc, hasher, set(confirmed_hashes), matcher, pages, on_page)
+    log_match_stats(log, matcher.hits, matcher.misses)
+    return doc
+
+def clean_parallel(file_path, doc, hasher, confirmed_hashes, confirmed_texts, executor=None, progress=None, log=None, tolerance=0.0, cancel=None, object_mode=False):
+    # 页数较多时由进程池按页区间并行定位水印 (耗时的 get_text 提取在子进程完成)，得到逐页删除计划后直接在 doc 上执行，
+    # 页面标签、链接、表单等文档级结构原样保留；页数较少时直接在本进程清理
+    # object_mode 时改为对象级清理 (见 clean_objects)
+    total = len(doc)
+    if object_mode:
+        return clean_objects(doc, hasher, confirmed_hashes, confirmed_texts, progress, log, tolerance, cancel)
+    if total < PARALLEL_CLEAN_MIN_PAGES:
+        return clean_document(doc, hasher, confirmed_hashes, confirmed_texts, progress, tolerance, log, cancel)
+    if log: log(f">>> Locating watermarks on {total} pages in parallel...")
+    keys = [(t['text'], tuple(t['bbox']), tuple(t['size'])) for t in confirmed_texts]
+    plan, hits, misses = prematch(file_path, total, hasher.aliases, confirmed_hashes, keys, executor,
+                                  progress and (lambda p: progress(p * 9 // 10)), cancel, tolerance)
+    log_match_stats(log, hits, misses)
+    return apply_plan(doc, select_plan(plan, confirmed_hashes, confirmed_texts), progress and (lambda p: progress(90 + p // 10)), log, cancel)
+
+# --- 4.1 预匹配 + 按计划清理 (GUI 流水线) ---
+# 用户确认期间先对全部候选做预匹配 (耗时的 get_text 提取在此完成)，得到逐页的删除计划；
+# 确认后只按勾选项过滤计划并执行，没有候选的页面完全不处理
+def prematch_chunk_worker(file_path, img_keys, txt_keys, aliases, tolerance, page_indices):
+    # 返回 (计划, 文本查找命中数, 未命中数)
+    plan = {}
+    matcher = TextMatcher([{'text': k[0], 'bbox': k[1], 'size': k[2]} for k in txt_keys], tolerance)
+    try:
+        with span("chunk.open"): doc, hasher = warm_document(file_path)
+        for i in page_indices:
+            page = doc[i]; cur_size = (round(page.rect.width, 1), round(page.rect.height, 1))
+            imgs = []; texts = []
+            if img_keys:
+                with span("prematch.images", page=i):
+                    for img in page.get_images():
+                        try: h = hasher.hash(img[0], aliases)
+                        except Exception: continue
+                        if h in img_keys: imgs.append((img[0], h))
+            if len(matcher):
+                with span("prematch.text", page=i): blocks = page.get_text("dict")["blocks"]
+                for b in blocks:
+                    if b["type"] != 0: continue
+                    for line in b["lines"]:
+                        txt = "".join([s["text"] for s in line["spans"]]).strip()
+                        key = matcher.lookup(txt, tuple([round(v, 1) for v in line["bbox"]]), cur_size)
+                        if key is not None: texts.append((key, tuple(line["bbox"])))
+            if imgs or texts: plan[i] = (imgs, texts)
+    except Exception: pass
+    return plan, matcher.hits, matcher.misses
+
+def prematch(file_path, total, aliases, img_candidates, txt_candidates, executor=None, progress=None, cancel=None, tolerance=0.0):
+    # 返回 (计划, 文本查找命中数, 未命中数)
+    img_keys = frozenset(img_candidates); txt_keys = list(txt_candidates)
+    workers = default_workers()
+    own = executor is None
+    if own: executor = ProcessPoolExecutor(max_workers=workers)
+    plan = {}; stats = [0, 0]; reporter = ScanProgress(total, progress=progress)
+    def on_result(batch, result):
+        part, hits, misses = result
+        plan.update(part); stats[0] += hits; stats[1] += misses
+        reporter.advance(len(batch))
+    try:
+        run_batches(executor, prematch_chunk_worker, batch_ranges(range(total), workers),
+                    (file_path, img_keys, txt_keys, aliases, tolerance), on_result, cancel)
+    finally:
+        if own: executor.shutdown(cancel_futures=True)
+    return plan, stats[0], stats[1]
+
+def select_plan(plan, confirmed_hashes, confirmed_texts):
+    # 按用户勾选过滤：{页码: ([要替换的图像 xref], [要 redact 的矩形])}
+    hashes = set(confirmed_hashes)
+    texts = set((t['text'], tuple(t['bbox']), tuple(t['size'])) for t in confirmed_texts)
+    selected = {}
+    for i, (imgs, lines) in plan.items():
+        xrefs = [x for x, h in imgs if h in hashes]; rects = [r for k, r in lines if k in texts]
+        if xrefs or rects: selected[i] = (xrefs, rects)
+    return selected
+
+def apply_pages(doc, page_plan, page_indices, on_page=None):
+    deleted = set()
+    for i in page_indices:
+        entry = page_plan.get(i)
+        if entry:
+            page = doc[i]; xrefs, rects = entry
+            for xref in xrefs:
+                if xref not in deleted: page.delete_image(xref); deleted.add(xref)
+            for r in rects: page.add_redact_annot(r)
+            if rects:
+                with span("clean.redact", page=i): page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE)
+        if on_page: on_page(i)
+
+def apply_plan(doc, page_plan, progress=None, log=None, cancel=None):
+    # 直接在 doc 上执行计划，只处理计划中的页面 (定位已在预匹配阶段并行完成)
+    total = len(doc)
+    if log: log(f">>> {len(page_plan)} of {total} pages contain selected watermarks.")
+    pages = sorted(page_plan); done = [0]
+    def on_page(_):
+        if cancel is not None and cancel.is_set(): raise Cancelled()
+        done[0] += 1
+        if progress: progress(int(done[0] / max(1, len(pages)) * 100))
+    apply_pages(doc, page_plan, pages, on_page)
+    if progress: progress(100)
+    return doc
+
+# --- 5. 保存 ---
+# fast: 只做基础垃圾回收、保留原有压缩流，出结果最快；standard: 原有行为；
+# compact: 去重 + 重新压缩图像/字体 + 对象流，适合归档
+SAVE_PROFILES = {
+    "fast": dict(garbage=1),
+    "standard": dict(garbage=4, deflate=True),
+    "compact": dict(garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True, use_objstms=1),
+}
+
+def save_options(profile):
+    # 旧版 PyMuPDF 不支持的参数 (如 use_objstms) 直接忽略
+    params = inspect.signature(fitz.Document.save).parameters
+    return {k: v for k, v in SAVE_PROFILES[profile].items() if k in params}
+
+def save_document(doc, target, profile="standard", log=None):
+    # target 可以是文件路径，也可以是可写的二进制文件对象 (如 sys.stdout.buffer)
+    start = time.perf_counter()
+    options = save_options(profile)
+    with span("save", profile=profile): size = _save(doc, target, options)
+    report = {'profile': profile, 'seconds': time.perf_counter() - start, 'bytes': size}
+    if log: log(f">>> Saved ({profile}): {size / 1048576:.2f} MB in {report['seconds']:.1f}s")
+    return report
+
+def _save(doc, target, options):
+    if isinstance(target, (str, os.PathLike)):
+        doc.save(target, **options)
+        size = os.path.getsize(target)
+    else:
+        # 文件对象 (含 sys.stdout.buffer、管道) 一律先生成完整数据再写出：PyMuPDF 会把带 .name 的流当作路径保存
+        data = doc.tobytes(**options)
+        target.write(data); target.flush()
+        size = len(data)
+    return size
+
+# --- 6. 对象级清理 ---
+# 不逐页做 redaction：确认的图像 XObject 在整个文档中只替换一次 (替换为全透明的 1x1 图像蒙版)；文本直接从内容流
+# (页面内容流与 Form XObject) 中删除 BT...ET 块，块的文本与起点位置都须与已确认的文本行一致
+BLANK_IMAGE = "<< /Type /XObject /Subtype /Image /Width 1 /Height 1 /ImageMask true /BitsPerComponent 1 >>"
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+FORM_DEPTH = 8  # Form XObject 嵌套层数上限
+PDF_WHITESPACE = b" \t\r\n\f\x00"
+PDF_DELIMS = b"()<>[]{}/%"
+TEXT_SHOW_OPS = {b"Tj", b"TJ", b"'", b'"'}
+STRING_ESCAPES = {ord("n"): 10, ord("r"): 13, ord("t"): 9, ord("b"): 8, ord("f"): 12}
+
+def _read_literal(data, i):
+    # 从 '(' 之后开始读取字面量字符串，返回 (解码后的字节, 结束位置)
+    out = bytearray(); depth = 1; n = len(data)
+    while i < n:
+        c = data[i]
+        if c == 0x5C:  # 反斜杠
+            i += 1
+            if i >= n: break
+            c = data[i]
+            if c in STRING_ESCAPES: out.append(STRING_ESCAPES[c])
+            elif 0x30 <= c <= 0x37:
+                j = i
+                while j < n and j < i + 3 and 0x30 <= data[j] <= 0x37: j += 1
+                out.append(int(data[i:j], 8) & 0xFF); i = j; continue
+            elif c in (0x0A, 0x0D): pass  # 续行
+            else: out.append(c)
+        elif c == 0x28: depth += 1; out.append(c)
+        elif c == 0x29:
+            depth -= 1
+            if depth == 0: return bytes(out), i + 1
+            out.append(c)
+        else: out.append(c)
+        i += 1
+    return bytes(out), n
+
+def content_tokens(data):
+    # 简易内容流词法分析，产出 (类型, 值, 起始, 结束)；类型为 str / op / other
+    i = 0; n = len(data)
+    while i < n:
+        c = data[i]
+        if c in PDF_WHITESPACE: i += 1; continue
+        start = i
+        if c == 0x25:  # 注释
+            while i < n and data[i] not in b"\r\n": i += 1
+            continue
+        if c == 0x28:
+            value, i = _read_literal(data, i + 1)
+            yield "str", value, start, i
+        elif c == 0x3C and data[i + 1:i + 2] != b"<":
+            j = data.find(b">", i)
+            j = n if j < 0 else j
+            hexs = bytes(ch for ch in data[i + 1:j] if ch not in PDF_WHITESPACE)
+            if len(hexs) % 2: hexs += b"0"
+            try: value = bytes.fromhex(hexs.decode("latin-1"))
+            except ValueError: value = b""
+            i = j + 1
+            yield "str", value, start, i
+        elif data[i:i + 2] in (b"<<", b">>"):
+            i += 2; yield "other", data[start:i], start, i
+        elif c in b"[]{}":
+            i += 1; yield "other", data[start:i], start, i
+        else:
+            i += 1
+            while i < n and data[i] not in PDF_WHITESPACE and data[i] not in PDF_DELIMS: i += 1
+            word = data[start:i]
+            if c == 0x2F or word[:1] in b"+-.0123456789":
+                yield "other", word, start, i
+            elif word == b"ID":
+                # 内联图像：跳过二进制数据直到 EI
+                j = i + 1
+                while True:
+                    j = data.find(b"EI", j)
+                    if j < 0: j = n; break
+                    if data[j - 1:j] in (b"", *[bytes([w]) for w in PDF_WHITESPACE]) and (j + 2 >= n or data[j + 2] in PDF_WHITESPACE): break
+                    j += 2
+                i = min(n, j + 2)
+                yield "other", b"EI", start, i
+            else:
+                yield "op", word, start, i
+
+def normalize_text(text):
+    return "".join(text.split())
+
+def text_blocks(data, ctm=IDENTITY, stack=()):
+    # 解析内容流，返回 (BT...ET 块 [(起点, 终点, 文本, 首次显示文本时的原点)], Do 调用 [(名称, CTM)], 结束时的 (CTM, q 栈))
+    # 坐标为该流的用户空间，ctm / stack 为流开始时的图形状态 (页面的多个内容流依次衔接)；
+    # 文本按 latin-1 解码并去掉空白，CID 字体等无法按单字节解码的文本不会与已确认文本相等
+    blocks = []; dos = []
+    ctm = fitz.Matrix(ctm); stack = [fitz.Matrix(m) for m in stack]
+    operands = []; strings = []
+    bt_start = None; tm = tlm = fitz.Matrix(IDENTITY); leading = 0.0; shown = []; origin = None
+    for kind, value, start, end in content_tokens(data):
+        if kind == "str": strings.append(value); continue
+        if kind == "other":
+            if value == b"[": strings = []
+            else:
+                try: operands.append(float(value))
+                except ValueError: operands.append(value)
+            continue
+        nums = [v for v in operands if isinstance(v, float)]
+        if value == b"q": stack.append(fitz.Matrix(ctm))
+        elif value == b"Q":
+            if stack: ctm = stack.pop()
+        elif value == b"cm" and len(nums) >= 6: ctm = fitz.Matrix(*nums[-6:]) * ctm
+        elif value == b"BT": bt_start = start; tm = tlm = fitz.Matrix(IDENTITY); shown = []; origin = None
+        elif value == b"ET" and bt_start is not None:
+            blocks.append((bt_start, end, normalize_text(b"".join(shown).decode("latin-1")), origin)); bt_start = None
+        elif value == b"Do" and operands and isinstance(operands[-1], bytes) and operands[-1][:1] == b"/":
+            dos.append((operands[-1][1:].decode("latin-1"), tuple(ctm)))
+        elif bt_start is not None:
+            if value == b"Tm" and len(nums) >= 6: tm = tlm = fitz.Matrix(*nums[-6:])
+            elif value in (b"Td", b"TD") and len(nums) >= 2:
+                tm = tlm = fitz.Matrix(1, 0, 0, 1, nums[-2], nums[-1]) * tlm
+                if value == b"TD": leading = -nums[-1]
+            elif value == b"TL" and nums: leading = nums[-1]
+            elif value in (b"T*", b"'", b'"'): tm = tlm = fitz.Matrix(1, 0, 0, 1, 0, -leading) * tlm
+            if value in TEXT_SHOW_OPS:
+                if origin is None: origin = fitz.Point(0, 0) * tm * ctm
+                shown.extend(strings)
+        operands = []; strings = []
+    return blocks, dos, (tuple(ctm), tuple(tuple(m) for m in stack))
+
+def cut_ranges(data, ranges):
+    out = bytearray(); pos = 0
+    for s, e in sorted(ranges): out += data[pos:s]; pos = e
+    out += data[pos:]
+    return bytes(out)
+
+def remove_objects(doc, hasher, confirmed_hashes, confirmed_texts, log=None, tolerance=0.0):
+    # 返回 (仍需逐页 redaction 的页码, 是否修改过对象)
+    confirmed_hashes = set(confirmed_hashes)
+    images = 0
+    if confirmed_hashes:
+        for xref in range(1, doc.xref_length()):
+            try:
+                if doc.xref_get_key(xref, "Subtype")[1] != "/Image": continue
+                if hasher.hash(xref) not in confirmed_hashes: continue
+            except Exception: continue
+            doc.update_object(xref, BLANK_IMAGE)
+            doc.update_stream(xref, b"\xff", compress=False)
+            images += 1
+
+    by_size = {}
+    for conf in confirmed_texts:
+        by_size.setdefault(tuple(conf['size']), []).append((normalize_text(conf['text']), tuple(conf['bbox'])))
+    if not by_size:
+        if log: log(f">>> Object-level removal: {images} image objects.")
+        return [], images > 0
+    slack = 2.0 + tolerance
+    parsed = {}  # (xref, 起始图形状态) -> text_blocks 结果，共享的内容流 / Form XObject 只解析一次
+    verdicts = {}  # (xref, 起点, 终点) -> 该块在每一处调用中都落在已确认文本行上
+    page_blocks = {}  # 页码 -> [(块, 文本)]
+
+    def parse(xref, state):
+        key = (xref,) + state
+        if key not in parsed: parsed[key] = text_blocks(doc.xref_stream(xref) or b"", *state)
+        return parsed[key]
+
+    def on_target(text, point, targets):
+        return point is not None and any(t == text and b[0] - slack <= point.x <= b[2] + slack and b[1] - slack <= point.y <= b[3] + slack
+                                         for t, b in targets)
+
+    def walk(i, xref, owner, state, base, targets, forms, depth):
+        # base 把该流的用户空间映射到页面坐标 (与 get_text 的 bbox 一致)
+        blocks, dos, end = parse(xref, state)
+        for start, stop, text, origin in blocks:
+            if not text: continue
+            block = (xref, start, stop)
+            verdicts[block] = verdicts.get(block, True) and on_target(text, origin * base if origin is not None else None, targets)
+            page_blocks[i].append((block, text))
+        for name, ctm in dos:
+            form = forms.get((owner, name))
+            if form is None or depth >= FORM_DEPTH: continue
+            t, v = doc.xref_get_key(form, "Matrix")
+            try: matrix = fitz.Matrix(*[float(n) for n in v.strip("[]").split()]) if t == "array" else fitz.Matrix(IDENTITY)
+            except (ValueError, TypeError): matrix = fitz.Matrix(IDENTITY)
+            walk(i, form, form, (IDENTITY, ()), matrix * fitz.Matrix(ctm) * base, targets, forms, depth + 1)
+        return end
+
+    # 先遍历所有页面收集每个块在各处调用中的判定，共享的块只有处处命中才删除
+    for i, page in enumerate(doc):
+        targets = by_size.get((round(page.rect.width, 1), round(page.rect.height, 1)), [])
+        forms = {(invoker, name): xref for xref, name, invoker, _ in page.get_xobjects()}
+        if not targets and not forms: continue
+        page_blocks[i] = []; state = (IDENTITY, ())
+        for xref in page.get_contents():
+            state = walk(i, xref, 0, state, page.transformation_matrix, targets, forms, 0)
+
+    cuts = {}
+    for (xref, start, stop), ok in verdicts.items():
+        if ok: cuts.setdefault(xref, []).append((start, stop))
+    for xref, ranges in cuts.items():
+        doc.update_stream(xref, cut_ranges(doc.xref_stream(xref), ranges))
+    removed = set(text for blocks in page_blocks.values() for block, text in blocks if verdicts[block])
+
+    # 回退：仍有未删除的块包含已确认文本 (如与正文同处一个 BT 块)，或某个已确认文本从未在内容流中命中 (无法解码) 的页面
+    pending = []
+    for i, blocks in page_blocks.items():
+        page = doc[i]
+        targets = by_size.get((round(page.rect.width, 1), round(page.rect.height, 1)))
+        if not targets: continue
+        if any(t not in removed for t, _ in targets) or any(not verdicts[block] and any(t in text for t, _ in targets) for block, text in blocks):
+            pending.append(i)
+    if log:
+        log(f">>> Object-level removal: {images} image objects, {sum(len(r) for r in cuts.values())} text blocks in {len(cuts)} content streams.")
+    return pending, bool(images or cuts)
+
+def clean_objects(doc, hasher, confirmed_hashes, confirmed_texts, progress=None, log=None, tolerance=0.0, cancel=None):
+    # 对象级清理；仍可能含有已确认文本的页面回退到逐页 redaction (不再处理图像)
+    # MuPDF 会缓存已解码的图像，修改过对象时从新数据重新载入文档，预览与保存的结果才一致 (返回新文档)
+    with span("objects"): pending, changed = remove_objects(doc, hasher, confirmed_hashes, confirmed_texts, log, tolerance)
+    if changed:
+        with span("objects.reload"): doc = fitz.open("pdf", doc.tobytes())
+    if pending:
+        if log: log(f">>> {len(pending)} pages need per-page redaction.")
+        clean_document(doc, hasher, (), confirmed_texts, progress, tolerance, log, cancel, pending)
+    elif progress: progress(100)
+    return doc
@@ -1,14 +1,20 @@
 import sys
 import os
-import xxhash
 import fitz
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from concurrent.futures import ProcessPoolExecutor
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout, QHBoxLayout,
                              QWidget, QFileDialog, QLabel, QProgressBar, QMessageBox, QTextEdit,  
-                             QDialog, QCheckBox, QScrollArea, QFrame, QSpinBox, QLineEdit, QComboBox)
-from PyQt6.QtGui import QPixmap, QImage, QTextCursor, QPainter, QPen, QColor
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QEvent, QSize
+                             QDialog, QCheckBox, QScrollArea, QSpinBox, QLineEdit, QComboBox, QListView)
+from PyQt6.QtGui import QPixmap, QImage, QTextCursor, QPainter, QPen, QColor, QFont, QFontMetrics
+from PyQt6.QtCore import (Qt, QThread, pyqtSignal, QEvent, QSize, QAbstractListModel, QModelIndex,
+                          QSortFilterProxyModel, QObject)
+from engine import (analyze, clean_parallel, save_document, Cancelled, ImageHasher, prematch, select_plan, make_rules, save_rules,
+                    expand_aliases, apply_plan, log_match_stats)
+from cache import AnalysisCache, default_cache_dir
+from templates import TemplateLibrary, make_template, clean_with_template
+import tracing
 
 # --- 环境适配 ---
 os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"] = "1"
@@ -37,7 +43,18 @@ TRANSLATIONS = {
         "set_title": "软件设置",
         "set_ratio": "疑似水印识别比例 (10-100%):",
         "set_lang": "语言 (Language):",
-        "set_save": "保存设置"
+        "set_save": "保存设置",
+        "cancel": "⏹ 取消",
+        "set_fast": "快速模式 (抽样检测，适合超大文档)",
+        "set_object": "对象级清除 (整份文档只处理一次水印对象)",
+        "set_near": "识别近似重复图像 (重新编码 / 轻微缩放的 logo，需要 numpy)",
+        "set_profile": "输出模式:",
+        "profile_fast": "快速 (体积较大)",
+        "profile_standard": "标准",
+        "profile_compact": "压缩 (适合归档，较慢)",
+        "set_trace": "记录性能追踪 (日志汇总 + Chrome trace 文件)",
+        "save_rules": "💾 将勾选项保存为规则...",
+        "set_templates": "水印模板 (记住确认结果，同来源文档跳过分析直接清理)"
     },
     "en": {
         "title": "Extreme PDF Cleaner",
@@ -61,13 +78,24 @@ TRANSLATIONS = {
         "set_title": "Settings",
         "set_ratio": "Watermark Ratio (10-100%):",
         "set_lang": "Language:",
-        "set_save": "Save Settings"
+        "set_save": "Save Settings",
+        "cancel": "⏹ Cancel",
+        "set_fast": "Fast mode (sampling, for huge documents)",
+        "set_object": "Object-level removal (each watermark object once)",
+        "set_near": "Detect near-duplicate images (re-encoded / resized logos, needs numpy)",
+        "set_profile": "Output profile:",
+        "profile_fast": "Fast (larger file)",
+        "profile_standard": "Standard",
+        "profile_compact": "Compact (archive, slower)",
+        "set_trace": "Record performance trace (log summary + Chrome trace file)",
+        "save_rules": "💾 Save Selection as Rules...",
+        "set_templates": "Watermark templates (remember confirmations, skip analysis for documents from the same source)"
     }
 }
 
 # --- 设置对话框 ---
 class SettingsDialog(QDialog):
-    def __init__(self, current_ratio, current_lang, scale, parent=None):
+    def __init__(self, current_ratio, current_lang, scale, fast_mode=False, object_mode=False, save_profile="standard", trace=False, near_mode=False, use_templates=False, parent=None):
         super().__init__(parent)
         self.scale = scale
         self.t = TRANSLATIONS[current_lang]
@@ -81,6 +109,28 @@ class SettingsDialog(QDialog):
         self.ratio_spin.setValue(current_ratio)
         self.ratio_spin.setSuffix("%")
         layout.addWidget(self.ratio_spin)
+        self.fast_check = QCheckBox(self.t["set_fast"])
+        self.fast_check.setChecked(fast_mode)
+        layout.addWidget(self.fast_check)
+        self.object_check = QCheckBox(self.t["set_object"])
+        self.object_check.setChecked(object_mode)
+        layout.addWidget(self.object_check)
+        self.near_check = QCheckBox(self.t["set_near"])
+        self.near_check.setChecked(near_mode)
+        layout.addWidget(self.near_check)
+        self.template_check = QCheckBox(self.t["set_templates"])
+        self.template_check.setChecked(use_templates)
+        layout.addWidget(self.template_check)
+
+        layout.addWidget(QLabel(self.t["set_profile"]))
+        self.profile_combo = QComboBox()
+        for name in ("fast", "standard", "compact"): self.profile_combo.addItem(self.t[f"profile_{name}"], name)
+        index = self.profile_combo.findData(save_profile)
+        self.profile_combo.setCurrentIndex(index if index >= 0 else 1)
+        layout.addWidget(self.profile_combo)
+        self.trace_check = QCheckBox(self.t["set_trace"])
+        self.trace_check.setChecked(trace)
+        layout.addWidget(self.trace_check)
         
         layout.addWidget(QLabel(self.t["set_lang"]))
         self.lang_combo = QComboBox()
@@ -95,48 +145,188 @@ class SettingsDialog(QDialog):
         layout.addWidget(self.btn_save)
 
     def get_values(self):
-        return self.ratio_spin.value(), self.lang_combo.currentData()
-
-# --- 1. 底层计算逻辑 ---
-def analyze_chunk_worker(file_path, page_indices):
-    results = []
-    doc = None
-    try:
-        doc = fitz.open(file_path)
-        for i in page_indices:
-            page = doc[i]
-            rect = page.rect
-            pw, ph = round(rect.width, 1), round(rect.height, 1)
-            page_data = {'index': i, 'size_key': (pw, ph), 'imgs': [], 'texts': []}
-            for img in page.get_images():
+        return self.ratio_spin.value(), self.lang_combo.currentData(), self.fast_check.isChecked(), self.object_check.isChecked(), self.profile_combo.currentData(), self.trace_check.isChecked(), self.near_check.isChecked(), self.template_check.isChecked()
+
+# --- 1. 交互确认对话框 ---
+def pixmap_to_qimage(pix):
+    # 统一转换为不带 alpha 的 RGB，再拷贝一份脱离 fitz 缓冲区 (可跨线程传递)
+    if pix.n - pix.alpha != 3: pix = fitz.Pixmap(fitz.csRGB, pix)
+    if pix.alpha: pix = fitz.Pixmap(pix, 0)
+    return QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format.Format_RGB888).copy()
+
+class ThumbnailLoader(QThread):
+    # 后台渲染缩略图：使用独立打开的文档，后请求的先处理 (即当前可见的行优先)
+    loaded = pyqtSignal(int, QImage)
+
+    def __init__(self, file_path, max_w, max_h):
+        super().__init__()
+        self.file_path = file_path; self.max_w = max_w; self.max_h = max_h
+        self.requests = []; self.pending = set()
+        self.cond = threading.Condition(); self.stopped = False
+
+    def request(self, row, item):
+        with self.cond:
+            if row in self.pending: return
+            self.pending.add(row); self.requests.append((row, item))
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True; self.cond.notify()
+
+    def render(self, doc, item):
+        info = item['info']
+        if item['kind'] == "img":
+            pix = fitz.Pixmap(doc, info['xref'])
+            while pix.width > self.max_w * 2 or pix.height > self.max_h * 2:
+                pix.shrink(1)  # 每次缩小一半，避免完整尺寸转换
+            return pixmap_to_qimage(pix)
+        clip_rect = fitz.Rect(item['key'][1]) + (-10, -5, 10, 5)
+        return pixmap_to_qimage(doc[info['sample_page']].get_pixmap(clip=clip_rect, matrix=fitz.Matrix(2, 2)))
+
+    def run(self):
+        doc = fitz.open(self.file_path)
+        try:
+            while True:
+                with self.cond:
+                    while not self.requests and not self.stopped: self.cond.wait()
+                    if self.stopped: return
+                    row, item = self.requests.pop()
+                    self.pending.discard(row)
+                try: qimg = self.render(doc, item)
+                except Exception: continue
+                self.loaded.emit(row, qimg)
+        finally:
+            doc.close()
+
+class LocationPreviewRenderer(QThread):
+    # 悬停预览的整页渲染：只保留最新请求，过期请求直接丢弃；页面 display list 常驻缓存
+    rendered = pyqtSignal(int, float, QImage)
+    DISPLAY_LIST_CACHE = 16
+
+    def __init__(self, file_path):
+        super().__init__()
+        self.file_path = file_path
+        self.latest = None
+        self.cond = threading.Condition(); self.stopped = False
+
+    def request(self, page_idx, zoom):
+        with self.cond:
+            self.latest = (page_idx, zoom); self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True; self.cond.notify()
+
+    def run(self):
+        doc = fitz.open(self.file_path); display_lists = OrderedDict()
+        try:
+            while True:
+                with self.cond:
+                    while self.latest is None and not self.stopped: self.cond.wait()
+                    if self.stopped: return
+                    page_idx, zoom = self.latest; self.latest = None
                 try:
-                    pix = fitz.Pixmap(doc, img[0])
-                    h = xxhash.xxh64(pix.samples).hexdigest()
-                    page_data['imgs'].append({'hash': h, 'xref': img[0]})
-                except: continue
-            blocks = page.get_text("dict")["blocks"]
-            for b in blocks:
-                if b["type"] != 0: continue
-                for line in b["lines"]:
-                    content = "".join([span["text"] for span in line["spans"]]).strip()
-                    if len(content) > 1:
-                        bbox = tuple([round(v, 1) for v in line["bbox"]])
-                        page_data['texts'].append({'text': content, 'bbox': bbox})
-            results.append(page_data)
-    except: pass
-    finally:
-        if doc: doc.close()
-    return results
-
-# --- 2. 交互确认对话框 ---
+                    dl = display_lists.pop(page_idx, None) or doc[page_idx].get_displaylist()
+                    display_lists[page_idx] = dl
+                    while len(display_lists) > self.DISPLAY_LIST_CACHE: display_lists.popitem(last=False)
+                    qimg = pixmap_to_qimage(dl.get_pixmap(matrix=fitz.Matrix(zoom, zoom)))
+                except Exception: continue
+                self.rendered.emit(page_idx, zoom, qimg)
+        finally:
+            doc.close()
+
+class CandidateModel(QAbstractListModel):
+    # 候选列表：只有视图实际请求 DecorationRole (即行可见) 时才加载缩略图；
+    # 行高由 SizeHintRole 直接给出 (标题行 / 候选行各一种)，视图计算布局时不会触发缩略图加载
+    LocRole = Qt.ItemDataRole.UserRole + 1
+    FilterRole = Qt.ItemDataRole.UserRole + 2
+    THUMB_CACHE = 300
+
+    def __init__(self, rows, t, loader, thumb_size):
+        super().__init__()
+        self.rows = rows; self.t = t; self.loader = loader
+        self.thumb_size = thumb_size
+        self.thumbs = OrderedDict()
+        self.placeholder = QPixmap(thumb_size); self.placeholder.fill(QColor(238, 238, 238))
+        self.header_font = QFont(); self.header_font.setBold(True)
+        self.header_size = QSize(thumb_size.width(), QFontMetrics(self.header_font).height() + 8)
+        self.item_size = QSize(thumb_size.width(), thumb_size.height() + 4)
+        loader.loaded.connect(self.on_loaded)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def flags(self, index):
+        if self.rows[index.row()]['kind'] == "header": return Qt.ItemFlag.ItemIsEnabled
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsUserCheckable
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        row = index.row(); item = self.rows[row]; kind = item['kind']
+        if role == Qt.ItemDataRole.DisplayRole:
+            if kind == "header": return self.t["img_header"] if item['key'] == "img" else self.t["txt_header"]
+            return f"{self.t['count']}: {item['info']['count']}"
+        if role == self.FilterRole:
+            return item['key'][0].lower() if kind == "txt" else None
+        if role == Qt.ItemDataRole.SizeHintRole:
+            return self.header_size if kind == "header" else self.item_size
+        if kind == "header":
+            if role == Qt.ItemDataRole.FontRole: return self.header_font
+            if role == Qt.ItemDataRole.ForegroundRole:
+                return QColor(231, 76, 60) if item['key'] == "img" else QColor(52, 152, 219)
+            return None
+        if role == Qt.ItemDataRole.CheckStateRole:
+            return Qt.CheckState.Checked if item['checked'] else Qt.CheckState.Unchecked
+        if role == Qt.ItemDataRole.ForegroundRole:
+            return QColor(231, 76, 60) if kind == "img" else QColor(52, 152, 219)
+        if role == Qt.ItemDataRole.DecorationRole:
+            pixmap = self.thumbs.get(row)
+            if pixmap is not None:
+                self.thumbs.move_to_end(row); return pixmap
+            self.loader.request(row, item)
+            return self.placeholder
+        if role == self.LocRole:
+            if kind == "img": return {"page": item['info']['sample_page'], "bbox": item['info']['sample_bbox'], "type": "img"}
+            return {"page": item['info']['sample_page'], "bbox": item['key'][1], "type": "txt"}
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.CheckStateRole: return False
+        self.rows[index.row()]['checked'] = Qt.CheckState(value) == Qt.CheckState.Checked
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def on_loaded(self, row, qimg):
+        self.thumbs[row] = QPixmap.fromImage(qimg).scaled(self.thumb_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+        while len(self.thumbs) > self.THUMB_CACHE: self.thumbs.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def set_all_checked(self, checked):
+        for item in self.rows:
+            if item['kind'] != "header": item['checked'] = checked
+        if self.rows:
+            self.dataChanged.emit(self.index(0), self.index(len(self.rows) - 1), [Qt.ItemDataRole.CheckStateRole])
+
+class CandidateFilterProxy(QSortFilterProxyModel):
+    # 过滤只作用于文本候选，图片与分组标题始终显示
+    def filterAcceptsRow(self, source_row, source_parent):
+        content = self.sourceModel().index(source_row, 0, source_parent).data(CandidateModel.FilterRole)
+        if content is None: return True
+        return self.filter_text in content
+
+    def set_filter_text(self, text):
+        self.filter_text = text.lower(); self.invalidateFilter()
+
 class EnhancedWatermarkDialog(QDialog):
-    def __init__(self, img_data, text_blocks, doc, lang="en", scale=1.0, parent=None):
+    def __init__(self, img_data, text_blocks, doc, lang="en", scale=1.0, parent=None, aliases=None):
+        # aliases 为分析得到的别名表，保存规则时把勾选的合并 key 展开为原始 key
         super().__init__(parent)
+        self.aliases = aliases or {}
         self.t = TRANSLATIONS[lang]
         self.setWindowTitle(self.t["dialog_title"])
         self.doc = doc
         self.scale = scale
-        self.img_boxes = {}; self.text_line_boxes = []; self.text_cards = []
         
         available_geom = QApplication.primaryScreen().availableGeometry()
         self.resize(int(available_geom.width() * 0.95), int(available_geom.height() * 0.85))
@@ -153,60 +343,32 @@ class EnhancedWatermarkDialog(QDialog):
         tool_layout.addWidget(btn_all); tool_layout.addWidget(btn_none); tool_layout.addWidget(self.search_bar)
         left_side.addLayout(tool_layout)
 
-        scroll = QScrollArea(); scroll.setWidgetResizable(True)
-        scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        content_widget = QWidget(); self.scroll_layout = QVBoxLayout(content_widget)
-
-        IMG_STAT_STYLE = "color: #e74c3c; font-weight: bold; font-size: 9pt;"
-        TXT_STAT_STYLE = "color: #3498db; font-weight: bold; font-size: 9pt;"
-
+        rows = []
         if img_data:
-            header_img = QLabel(f"<b>{self.t['img_header']}</b>")
-            header_img.setStyleSheet("color: #e74c3c;")
-            self.scroll_layout.addWidget(header_img)
-            for h, info in img_data.items():
-                frame = QFrame(); frame.setFrameStyle(QFrame.Shape.StyledPanel)
-                l = QHBoxLayout(frame); l.setContentsMargins(5, 5, 5, 5)
-                cb = QCheckBox(""); cb.setChecked(False); self.img_boxes[h] = cb
-                pix = fitz.Pixmap(self.doc, info['xref'])
-                qimg = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format.Format_RGB888)
-                lab = QLabel()
-                lab.setPixmap(QPixmap.fromImage(qimg).scaled(int(150*scale), int(80*scale), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
-                # 设置 type 为 img
-                lab.setProperty("loc_info", {"page": info['sample_page'], "bbox": info['sample_bbox'], "type": "img"})
-                lab.installEventFilter(self)
-                l.addWidget(cb); l.addWidget(lab); l.addStretch()
-                l.addWidget(QLabel(f"<span style='{IMG_STAT_STYLE}'>{self.t['count']}: {info['count']}</span>"))
-                self.scroll_layout.addWidget(frame)
-
+            rows.append({'kind': "header", 'key': "img"})
+            rows += [{'kind': "img", 'key': h, 'info': info, 'checked': False} for h, info in img_data.items()]
         if text_blocks:
-            header_txt = QLabel(f"<b>{self.t['txt_header']}</b>")
-            header_txt.setStyleSheet("color: #3498db;")
-            self.scroll_layout.addWidget(header_txt)
-            for key, info in text_blocks.items():
-                frame = QFrame(); frame.setFrameStyle(QFrame.Shape.StyledPanel)
-                row_layout = QHBoxLayout(frame); row_layout.setContentsMargins(5, 5, 5, 5)
-                cb = QCheckBox(); cb.setChecked(False)
-                row_layout.addWidget(cb)
-                try:
-                    sample_page = self.doc[info['sample_page']]
-                    clip_rect = fitz.Rect(key[1]) + (-10, -5, 10, 5)
-                    pix = sample_page.get_pixmap(clip=clip_rect, matrix=fitz.Matrix(2, 2))
-                    qimg = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format.Format_RGB888)
-                    img_lab = QLabel()
-                    img_lab.setPixmap(QPixmap.fromImage(qimg).scaled(int(220*scale), int(60*scale), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
-                    # 设置 type 为 txt
-                    img_lab.setProperty("loc_info", {"page": info['sample_page'], "bbox": key[1], "type": "txt"})
-                    img_lab.installEventFilter(self)
-                    row_layout.addWidget(img_lab)
-                except: pass
-                row_layout.addStretch()
-                row_layout.addWidget(QLabel(f"<span style='{TXT_STAT_STYLE}'>{self.t['count']}: {info['count']}</span>"))
-                self.text_line_boxes.append({'checkbox': cb, 'content': key[0], 'bbox': key[1], 'size': key[2]})
-                self.text_cards.append((frame, key[0].lower()))
-                self.scroll_layout.addWidget(frame)
-
-        scroll.setWidget(content_widget); left_side.addWidget(scroll)
+            rows.append({'kind': "header", 'key': "txt"})
+            rows += [{'kind': "txt", 'key': key, 'info': info, 'checked': False} for key, info in text_blocks.items()]
+
+        thumb_size = QSize(int(220 * scale), int(60 * scale))
+        self.loader = ThumbnailLoader(doc.name, thumb_size.width(), thumb_size.height())
+        self.model = CandidateModel(rows, self.t, self.loader, thumb_size)
+        self.proxy = CandidateFilterProxy(); self.proxy.set_filter_text("")
+        self.proxy.setSourceModel(self.model)
+
+        self.view = QListView()
+        self.view.setModel(self.proxy)
+        self.view.setIconSize(thumb_size)
+        self.view.setSpacing(2)
+        self.view.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.view.setMouseTracking(True)
+        self.view.entered.connect(self.on_item_hovered)
+        left_side.addWidget(self.view)
+        self.loader.start()
+
+        btn_rules = QPushButton(self.t["save_rules"]); btn_rules.clicked.connect(self.save_selection_rules)
+        left_side.addWidget(btn_rules)
         btn_ok = QPushButton(self.t["ok"]); btn_ok.clicked.connect(self.accept)
         btn_ok.setFixedHeight(int(45*scale)); left_side.addWidget(btn_ok)
         
@@ -215,149 +377,392 @@ class EnhancedWatermarkDialog(QDialog):
         self.location_preview.setStyleSheet("border: 2px solid #ddd; background: #ffffff; border-radius: 5px;")
         main_layout.addWidget(left_container); main_layout.addWidget(self.location_preview, 1)
 
-    def eventFilter(self, source, event):
-        if event.type() == QEvent.Type.Enter:
-            loc = source.property("loc_info")
-            if loc: self.show_location_on_page(loc["page"], loc["bbox"], loc["type"])
-            return True
-        return super().eventFilter(source, event)
+        # 悬停预览：(页码, 缩放) -> 已渲染的整页底图，椭圆标记画在副本上
+        self.base_pixmaps = OrderedDict(); self.page_rects = {}; self.hover_loc = None
+        self.preview_renderer = LocationPreviewRenderer(doc.name)
+        self.preview_renderer.rendered.connect(self.on_preview_rendered)
+        self.preview_renderer.start()
+
+    def on_item_hovered(self, index):
+        loc = index.data(CandidateModel.LocRole)
+        if loc: self.show_location_on_page(loc["page"], loc["bbox"], loc["type"])
+
+    def done(self, result):
+        self.loader.stop(); self.preview_renderer.stop()
+        self.loader.wait(); self.preview_renderer.wait()
+        super().done(result)
+
+    BASE_PIXMAP_CACHE = 24
 
     def show_location_on_page(self, page_idx, bbox, mark_type):
         try:
-            page = self.doc[page_idx]
+            rect = self.page_rects.get(page_idx)
+            if rect is None: rect = self.page_rects[page_idx] = self.doc[page_idx].rect
             view_w, view_h = self.location_preview.width() - 20, self.location_preview.height() - 20
-            zoom = min(view_w / page.rect.width, view_h / page.rect.height)
-            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
-            pixmap = QPixmap.fromImage(QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format.Format_RGB888))
-            
-            painter = QPainter(pixmap)
-            # 根据类型设置颜色：图片为红，文字为蓝
-            color = QColor(231, 76, 60) if mark_type == "img" else QColor(52, 152, 219)
-            painter.setPen(QPen(color, 2, Qt.PenStyle.SolidLine))
-            
-            # 计算适配大小的椭圆 (尺寸大一圈)
-            target_rect = fitz.Rect(bbox) * zoom
-            padding = 6 # 椭圆比实际内容多出的边距
-            ellipse_rect = target_rect.irect # 获取整数矩形
-            ellipse_rect.x0 -= padding
-            ellipse_rect.y0 -= padding
-            ellipse_rect.x1 += padding
-            ellipse_rect.y1 += padding
-            
-            painter.drawEllipse(ellipse_rect.x0, ellipse_rect.y0, ellipse_rect.width, ellipse_rect.height)
-            painter.end()
-            self.location_preview.setPixmap(pixmap)
-        except: pass
+            zoom = round(min(view_w / rect.width, view_h / rect.height), 4)
+        except Exception: return
+        self.hover_loc = (page_idx, zoom, bbox, mark_type)
+        base = self.base_pixmaps.get((page_idx, zoom))
+        if base is None:
+            self.preview_renderer.request(page_idx, zoom)
+            return
+        self.base_pixmaps.move_to_end((page_idx, zoom))
+        self.paint_location(base, zoom, bbox, mark_type)
+
+    def on_preview_rendered(self, page_idx, zoom, qimg):
+        self.base_pixmaps[(page_idx, zoom)] = QPixmap.fromImage(qimg)
+        while len(self.base_pixmaps) > self.BASE_PIXMAP_CACHE: self.base_pixmaps.popitem(last=False)
+        if self.hover_loc and self.hover_loc[:2] == (page_idx, zoom):
+            self.paint_location(self.base_pixmaps[(page_idx, zoom)], zoom, *self.hover_loc[2:])
+
+    def paint_location(self, base, zoom, bbox, mark_type):
+        pixmap = base.copy()
+        painter = QPainter(pixmap)
+        # 根据类型设置颜色：图片为红，文字为蓝
+        color = QColor(231, 76, 60) if mark_type == "img" else QColor(52, 152, 219)
+        painter.setPen(QPen(color, 2, Qt.PenStyle.SolidLine))
+        
+        # 计算适配大小的椭圆 (尺寸大一圈)
+        target_rect = fitz.Rect(bbox) * zoom
+        padding = 6 # 椭圆比实际内容多出的边距
+        ellipse_rect = target_rect.irect # 获取整数矩形
+        ellipse_rect.x0 -= padding
+        ellipse_rect.y0 -= padding
+        ellipse_rect.x1 += padding
+        ellipse_rect.y1 += padding
+        
+        painter.drawEllipse(ellipse_rect.x0, ellipse_rect.y0, ellipse_rect.width, ellipse_rect.height)
+        painter.end()
+        self.location_preview.setPixmap(pixmap)
 
     def select_all(self):
-        for cb in self.img_boxes.values(): cb.setChecked(True)
-        for item in self.text_line_boxes: item['checkbox'].setChecked(True)
+        self.model.set_all_checked(True)
     def select_none(self):
-        for cb in self.img_boxes.values(): cb.setChecked(False)
-        for item in self.text_line_boxes: item['checkbox'].setChecked(False)
+        self.model.set_all_checked(False)
     def filter_items(self, text):
-        for frame, content in self.text_cards: frame.setVisible(text.lower() in content)
+        self.proxy.set_filter_text(text)
     def get_selection(self):
-        imgs = [h for h, cb in self.img_boxes.items() if cb.isChecked()]
-        txts = [{'text': i['content'], 'bbox': i['bbox'], 'size': i['size']} for i in self.text_line_boxes if i['checkbox'].isChecked()]
+        rows = self.model.rows
+        imgs = [r['key'] for r in rows if r['kind'] == "img" and r['checked']]
+        txts = [{'text': r['key'][0], 'bbox': r['key'][1], 'size': r['key'][2]} for r in rows if r['kind'] == "txt" and r['checked']]
         return imgs, txts
+    def save_selection_rules(self):
+        # 规则文件可供 CLI (--rules) 与服务模式 (--rules 目录) 复用
+        stem = os.path.splitext(os.path.basename(self.doc.name))[0]
+        path, _ = QFileDialog.getSaveFileName(self, "Rules", f"{stem}.rules.json", "JSON (*.json)")
+        if not path: return
+        hashes, texts = self.get_selection()
+        try: save_rules(path, make_rules(expand_aliases(hashes, self.aliases), texts, name=stem))
+        except OSError as e: QMessageBox.critical(self, "Error", str(e))
+
+# --- 2. 后台清理流水线 ---
+class AnalysisWorker(QThread):
+    # 阶段 1：扫描候选，结束后立即关闭文档，不在确认期间占用资源
+    progress = pyqtSignal(int)
+    log_signal = pyqtSignal(str)
+    analyzed = pyqtSignal(dict, dict, object)
+    template_matched = pyqtSignal(object, float)
+    cancelled = pyqtSignal()
 
-# --- 3. 后台清理工作线程 ---
-class MasterWorker(QThread):
+    def __init__(self, file_path, ratio_threshold, fast_mode, near_mode, cancel_event, library=None):
+        super().__init__()
+        self.file_path = file_path; self.ratio_threshold = ratio_threshold
+        self.fast_mode = fast_mode; self.near_mode = near_mode; self.cancel_event = cancel_event
+        self.library = library
+
+    def run(self):
+        try:
+            if self.library is not None:
+                # 命中模板时不做分析，也不需要用户确认
+                template, score = self.library.match_file(self.file_path)
+                if template: return self.template_matched.emit(template, score)
+            doc, hasher, img_candidates, txt_candidates = analyze(self.file_path, self.ratio_threshold, log=self.log_signal.emit, cache=AnalysisCache(),
+                                                                  progress=self.progress.emit, cancel=self.cancel_event, fast=self.fast_mode, near=self.near_mode)
+            aliases = hasher.aliases; doc.close()
+            self.analyzed.emit(img_candidates, txt_candidates, aliases)
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.log_signal.emit(f"Error: {e}")
+            self.cancelled.emit()
+
+class PrematchWorker(QThread):
+    # 阶段 2 (与确认对话框并行)：预先定位所有候选所在的页面和区域，无候选的页面直接跳过
+    log_signal = pyqtSignal(str)
+    planned = pyqtSignal(object)
+    cancelled = pyqtSignal()
+
+    def __init__(self, file_path, aliases, img_candidates, txt_candidates, cancel_event):
+        super().__init__()
+        self.file_path = file_path; self.aliases = aliases
+        self.img_candidates = img_candidates; self.txt_candidates = txt_candidates
+        self.cancel_event = cancel_event
+
+    def run(self):
+        try:
+            with fitz.open(self.file_path) as doc: total = len(doc)
+            plan, hits, misses = prematch(self.file_path, total, self.aliases, self.img_candidates, self.txt_candidates, cancel=self.cancel_event)
+            log_match_stats(self.log_signal.emit, hits, misses)
+            self.log_signal.emit(f">>> Pre-matched candidates: {len(plan)} of {total} pages need cleaning.")
+            self.planned.emit(plan)
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            # 预匹配失败不影响结果，确认后退回完整清理
+            self.log_signal.emit(f">>> Pre-match skipped: {e}")
+            self.planned.emit(None)
+
+class CleanWorker(QThread):
+    # 阶段 3：按确认结果执行清理；有预匹配计划时只处理计划中的页面
     progress = pyqtSignal(int)
-    log_signal = pyqtSignal(str) 
+    log_signal = pyqtSignal(str)
+    finished = pyqtSignal(object)
+    cancelled = pyqtSignal()
+
+    def __init__(self, file_path, aliases, plan, confirmed_hashes, confirmed_texts, object_mode, cancel_event, tolerance=0.0, library=None, template=None):
+        # template 为命中的模板：按模板清理 (含新文档的别名解析)，不使用 aliases / plan
+        super().__init__()
+        self.file_path = file_path; self.aliases = aliases; self.plan = plan
+        self.confirmed_hashes = confirmed_hashes; self.confirmed_texts = confirmed_texts
+        self.object_mode = object_mode; self.cancel_event = cancel_event
+        self.tolerance = tolerance; self.library = library; self.template = template
+
+    def save_template(self, doc):
+        # 指纹取自清理前的文档；前几页找不到已确认的水印时不保存
+        name = os.path.splitext(os.path.basename(self.file_path))[0]
+        try:
+            template = make_template(doc, self.confirmed_hashes, self.confirmed_texts, self.aliases, name)
+            self.log_signal.emit(f">>> Template '{self.library.add(template)}' saved.")
+        except (ValueError, OSError) as e:
+            self.log_signal.emit(f">>> Template not saved: {e}")
+
+    def clean(self):
+        doc = fitz.open(self.file_path)
+        if self.library is not None and (self.confirmed_hashes or self.confirmed_texts): self.save_template(doc)
+        if self.plan is not None:
+            cleaned = apply_plan(doc, select_plan(self.plan, self.confirmed_hashes, self.confirmed_texts),
+                                 progress=self.progress.emit, log=self.log_signal.emit, cancel=self.cancel_event)
+        else:
+            hasher = ImageHasher(doc); hasher.aliases = self.aliases
+            cleaned = clean_parallel(self.file_path, doc, hasher, self.confirmed_hashes, self.confirmed_texts,
+                                     progress=self.progress.emit, log=self.log_signal.emit, tolerance=self.tolerance,
+                                     cancel=self.cancel_event, object_mode=self.object_mode)
+        return doc, cleaned
+
+    def run(self):
+        try:
+            self.log_signal.emit(">>> Applying cleaning process...")
+            self.progress.emit(0)
+            if self.template is not None:
+                doc, cleaned = clean_with_template(self.file_path, self.template, progress=self.progress.emit, log=self.log_signal.emit,
+                                                   cancel=self.cancel_event, object_mode=self.object_mode)
+            else:
+                doc, cleaned = self.clean()
+            if cleaned is not doc: doc.close()
+            self.log_signal.emit(">>> Done! Cleaned PDF is ready for preview/save.")
+            self.finished.emit(cleaned)
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.log_signal.emit(f"Error: {e}")
+            self.cancelled.emit()
+
+class CleanPipeline(QObject):
+    # 分析 -> (确认 || 预匹配) -> 清理，各阶段由信号衔接；确认结果与预匹配计划都就绪后才启动清理
+    progress = pyqtSignal(int)
+    log_signal = pyqtSignal(str)
     need_confirm = pyqtSignal(dict, dict)
     finished = pyqtSignal(object)
+    cancelled = pyqtSignal()
 
-    def __init__(self, file_path, ratio_threshold=30):
+    def __init__(self, file_path, ratio_threshold=30, fast_mode=False, object_mode=False, near_mode=False, use_templates=False):
         super().__init__()
         self.file_path = file_path
         self.ratio_threshold = ratio_threshold / 100.0
-        self.confirmed_hashes = []; self.confirmed_texts = []
-        self.is_confirmed = False
+        self.fast_mode = fast_mode; self.object_mode = object_mode; self.near_mode = near_mode
+        self.library = TemplateLibrary() if use_templates else None; self.template = None
+        self.cancel_event = threading.Event()
+        self.stages = []; self.active = False
+        self.aliases = {}; self.selection = None; self.plan = None; self.plan_ready = False
+
+    def _start_stage(self, stage):
+        stage.log_signal.connect(self.log_signal)
+        stage.cancelled.connect(self._stopped)
+        self.stages.append(stage); stage.start()
+
+    def start(self):
+        self.active = True
+        stage = AnalysisWorker(self.file_path, self.ratio_threshold, self.fast_mode, self.near_mode, self.cancel_event, self.library)
+        stage.progress.connect(self.progress)
+        stage.analyzed.connect(self._analyzed)
+        stage.template_matched.connect(self._template_matched)
+        self._start_stage(stage)
+
+    def isRunning(self):
+        return self.active
+
+    def wait(self):
+        for stage in self.stages: stage.wait()
+
+    def cancel(self):
+        self.cancel_event.set()
+        if not any(stage.isRunning() for stage in self.stages): self._stopped()
+
+    def confirm(self, confirmed_hashes, confirmed_texts):
+        self.selection = (confirmed_hashes, confirmed_texts)
+        self._try_clean()
+
+    def _analyzed(self, img_candidates, txt_candidates, aliases):
+        self.aliases = aliases
+        if self.object_mode or not (img_candidates or txt_candidates): self.plan_ready = True  # 对象级清理不使用页面计划
+        else:
+            stage = PrematchWorker(self.file_path, aliases, img_candidates, txt_candidates, self.cancel_event)
+            stage.planned.connect(self._planned)
+            self._start_stage(stage)
+        self.log_signal.emit(">>> Waiting for user confirmation...")
+        self.need_confirm.emit(img_candidates, txt_candidates)
+
+    def _template_matched(self, template, score):
+        # 模板直接给出确认结果，跳过预匹配和确认对话框
+        self.template = template; self.plan_ready = True
+        self.log_signal.emit(f">>> Matched template '{template['name']}' ({score:.0%}): analysis skipped.")
+        self.confirm(template['images'], template['texts'])
+
+    def _planned(self, plan):
+        self.plan = plan; self.plan_ready = True
+        self._try_clean()
+
+    def _try_clean(self):
+        if not self.active: return
+        if self.cancel_event.is_set(): return self._stopped()
+        if self.selection is None or not self.plan_ready: return
+        if self.template: stage = CleanWorker(self.file_path, {}, None, *self.selection, self.object_mode, self.cancel_event, template=self.template)
+        else: stage = CleanWorker(self.file_path, self.aliases, self.plan, *self.selection, self.object_mode, self.cancel_event, library=self.library)
+        stage.progress.connect(self.progress)
+        stage.finished.connect(self._finished)
+        self._start_stage(stage)
+
+    def _finished(self, doc):
+        self.active = False
+        self.finished.emit(doc)
+
+    def _stopped(self):
+        if not self.active: return
+        self.active = False; self.cancel_event.set()
+        self.log_signal.emit(">>> Cancelled.")
+        self.cancelled.emit()
+
+class SaveWorker(QThread):
+    # 后台保存，保存期间持有预览渲染锁，避免与渲染线程同时访问文档
+    log_signal = pyqtSignal(str)
+    saved = pyqtSignal(str)
+
+    def __init__(self, doc, path, profile, lock):
+        super().__init__()
+        self.doc = doc; self.path = path; self.profile = profile; self.lock = lock
 
     def run(self):
         try:
-            self.log_signal.emit(">>> Starting analysis...")
-            doc = fitz.open(self.file_path)
-            total = len(doc); all_page_results = []
-            cpu_count = max(1, (os.cpu_count() or 4) - 1)
-            chunk_size = max(1, total // cpu_count)
-            ranges = [list(range(i, min(i + chunk_size, total))) for i in range(0, total, chunk_size)]
-            
-            self.log_signal.emit(f">>> PDF loaded: {total} pages. Using {cpu_count} CPU cores.")
-            
-            with ProcessPoolExecutor(max_workers=cpu_count) as executor:
-                futures = [executor.submit(analyze_chunk_worker, self.file_path, r) for r in ranges]
-                for i, f in enumerate(futures):
-                    all_page_results.extend(f.result())
-                    self.log_signal.emit(f">>> Scanning progress: {int((i+1)/len(futures)*100)}%")
-
-            size_groups = {}
-            for data in all_page_results:
-                size_groups.setdefault(data['size_key'], []).append(data)
-
-            final_img_candidates = {}; final_txt_candidates = {}
-            for size_key, pages in size_groups.items():
-                group_count = len(pages)
-                threshold = max(2, group_count * self.ratio_threshold) 
-                img_counts = {}; txt_counts = {}
-                for p in pages:
-                    unique_hashes = set(img['hash'] for img in p['imgs'])
-                    for h in unique_hashes:
-                        img_counts[h] = img_counts.get(h, 0) + 1
-                        if h not in final_img_candidates:
-                            for img in p['imgs']:
-                                if img['hash'] == h:
-                                    img_rect = doc[p['index']].get_image_rects(img['xref'])[0]
-                                    final_img_candidates[h] = {'xref': img['xref'], 'count': 0, 'sample_page': p['index'], 'sample_bbox': tuple(img_rect)}
-                    for t in p['texts']:
-                        tk = (t['text'], t['bbox'], size_key)
-                        txt_counts[tk] = txt_counts.get(tk, 0) + 1
-                        if tk not in final_txt_candidates:
-                            final_txt_candidates[tk] = {'sample_page': p['index'], 'count': 0}
-
-                for h, count in img_counts.items():
-                    if count >= threshold: final_img_candidates[h]['count'] += count
-                for tk, count in txt_counts.items():
-                    if count >= threshold: final_txt_candidates[tk]['count'] += count
-
-            final_img_candidates = {k: v for k, v in final_img_candidates.items() if v['count'] > 0}
-            final_txt_candidates = {k: v for k, v in final_txt_candidates.items() if v['count'] > 0}
-
-            self.log_signal.emit(">>> Waiting for user confirmation...")
-            self.need_confirm.emit(final_img_candidates, final_txt_candidates)
-            while not self.is_confirmed: self.msleep(50)
-            
-            self.log_signal.emit(">>> Applying cleaning process...")
-            for i in range(total):
-                page = doc[i]; pw, ph = round(page.rect.width, 1), round(page.rect.height, 1); cur_size = (pw, ph)
-                for img in page.get_images():
-                    pix = fitz.Pixmap(doc, img[0])
-                    if xxhash.xxh64(pix.samples).hexdigest() in self.confirmed_hashes: page.delete_image(img[0])
-                p_dict = page.get_text("dict")
-                for b in p_dict["blocks"]:
-                    if b["type"] != 0: continue
-                    for line in b["lines"]:
-                        txt = "".join([s["text"] for s in line["spans"]]).strip()
-                        bbox = tuple([round(v, 1) for v in line["bbox"]])
-                        for conf in self.confirmed_texts:
-                            if txt == conf['text'] and bbox == conf['bbox'] and cur_size == conf['size']:
-                                page.add_redact_annot(line["bbox"])
-                page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE)
-                self.progress.emit(int((i + 1) / total * 100))
-            
-            self.log_signal.emit(">>> Done! Cleaned PDF is ready for preview/save.")
-            self.finished.emit(doc)
-        except Exception as e: self.log_signal.emit(f"Error: {e}")
+            with self.lock: save_document(self.doc, self.path, self.profile, self.log_signal.emit)
+            self.saved.emit(self.path)
+        except Exception as e:
+            self.log_signal.emit(f"Error: {e}")
+            self.saved.emit("")
+
+class PreviewRenderService(QThread):
+    # 主界面双栏预览的后台渲染：原文档 / 清理后文档各自的 display list 与渲染结果均为有界 LRU，
+    # 只处理最新的翻页请求，空闲时沿翻页方向预取相邻页面
+    rendered = pyqtSignal(str, int, QSize, QImage)
+    DISPLAY_LIST_CACHE = 32
+    IMAGE_CACHE = 12
+    PREFETCH = 2
 
-# --- 4. 主程序窗口 ---
+    def __init__(self):
+        super().__init__()
+        self.docs = {}; self.display_lists = OrderedDict(); self.images = OrderedDict()
+        self.latest = None
+        self.lock = threading.RLock()  # 保护 fitz 文档与缓存，其他线程访问 docs 时也需持有
+        self.cond = threading.Condition(); self.stopped = False
+
+    def set_document(self, key, doc):
+        with self.lock:
+            old = self.docs.pop(key, None)
+            if old is not None and old is not doc and key == "orig": old.close()
+            if doc is not None: self.docs[key] = doc
+            for cache in (self.display_lists, self.images):
+                for k in [k for k in cache if k[0] == key]: del cache[k]
+
+    def cached(self, key, page_idx, size):
+        # GUI 线程调用，锁被占用 (渲染或保存中) 时不等待
+        if not self.lock.acquire(blocking=False): return None
+        try:
+            img = self.images.get((key, page_idx, size.width(), size.height()))
+            if img is not None: self.images.move_to_end((key, page_idx, size.width(), size.height()))
+            return img
+        finally:
+            self.lock.release()
+
+    def request(self, page_idx, sizes, direction):
+        # sizes: {文档 key: 目标 QSize}；新请求会覆盖尚未处理的旧请求及预取
+        with self.cond:
+            self.latest = (page_idx, sizes, direction); self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True; self.cond.notify()
+
+    def has_newer(self):
+        with self.cond:
+            return self.latest is not None or self.stopped
+
+    def render(self, key, page_idx, size):
+        with self.lock:
+            doc = self.docs.get(key)
+            if doc is None or not 0 <= page_idx < len(doc): return None
+            ikey = (key, page_idx, size.width(), size.height())
+            img = self.images.get(ikey)
+            if img is not None: return img
+            dl = self.display_lists.pop((key, page_idx), None) or doc[page_idx].get_displaylist()
+            self.display_lists[(key, page_idx)] = dl
+            while len(self.display_lists) > self.DISPLAY_LIST_CACHE: self.display_lists.popitem(last=False)
+            rect = dl.rect
+            zoom = min(size.width() / rect.width, size.height() / rect.height)
+            img = pixmap_to_qimage(dl.get_pixmap(matrix=fitz.Matrix(zoom, zoom)))
+            self.images[ikey] = img
+            while len(self.images) > self.IMAGE_CACHE: self.images.popitem(last=False)
+            return img
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.latest is None and not self.stopped: self.cond.wait()
+                if self.stopped: return
+                page_idx, sizes, direction = self.latest; self.latest = None
+            for key, size in sizes.items():
+                try: img = self.render(key, page_idx, size)
+                except Exception: img = None
+                if img is not None: self.rendered.emit(key, page_idx, size, img)
+            for step in range(1, self.PREFETCH + 1):
+                if self.has_newer(): break
+                for key, size in sizes.items():
+                    try: self.render(key, page_idx + direction * step, size)
+                    except Exception: pass
+
+# --- 3. 主程序窗口 ---
 class UltraAppFinal(QMainWindow):
     def __init__(self):
         super().__init__()
         self.doc_orig = self.doc_clean = None
-        self.display_lists = {}; self.file_path = ""
+        self.file_path = ""
+        self.worker = None
+        self.last_page = 0
+        self.renderer = PreviewRenderService()
+        self.renderer.rendered.connect(self.on_preview_rendered)
+        self.renderer.start()
         self.ratio_threshold = 30
+        self.fast_mode = False; self.object_mode = False; self.near_mode = False; self.use_templates = False
+        self.save_profile = "standard"; self.saver = None
+        self.trace = False; self.trace_path = None
         self.lang = "en"
         
         self.scale = QApplication.primaryScreen().logicalDotsPerInch() / 96.0
@@ -402,7 +807,7 @@ class UltraAppFinal(QMainWindow):
         t = TRANSLATIONS[self.lang]
         self.setWindowTitle(t["title"])
         self.btn_open.setText(t["open"])
-        self.btn_clean.setText(t["clean"])
+        self.btn_clean.setText(t["cancel"] if self.worker_running() else t["clean"])
         self.btn_save.setText(t["save"])
         self.btn_settings.setText(t["settings"])
         self.lab_orig.setText(t["orig"])
@@ -411,9 +816,9 @@ class UltraAppFinal(QMainWindow):
             self.total_label.setText(f"/ {len(self.doc_orig)} {t['page']}")
 
     def show_settings(self):
-        dialog = SettingsDialog(self.ratio_threshold, self.lang, self.scale, self)
+        dialog = SettingsDialog(self.ratio_threshold, self.lang, self.scale, self.fast_mode, self.object_mode, self.save_profile, self.trace, self.near_mode, self.use_templates, self)
         if dialog.exec():
-            self.ratio_threshold, self.lang = dialog.get_values()
+            self.ratio_threshold, self.lang, self.fast_mode, self.object_mode, self.save_profile, self.trace, self.near_mode, self.use_templates = dialog.get_values()
             self.refresh_ui_text()
 
     def add_log(self, text):
@@ -428,61 +833,119 @@ class UltraAppFinal(QMainWindow):
             return True
         return super().eventFilter(source, event)
 
+    def preview_sizes(self):
+        sizes = {}
+        for key, scroll in (("orig", self.scroll_orig), ("clean", self.scroll_clean)):
+            if key == "clean" and not self.doc_clean: continue
+            sizes[key] = QSize(max(1, scroll.viewport().width() - 5), max(1, scroll.viewport().height() - 5))
+        return sizes
+
     def update_previews(self):
         if not self.doc_orig: return
         idx = self.page_spin.value() - 1
-        def render_to_label(doc, lab, scroll):
-            try:
-                page_data = self.display_lists.get(idx) if doc == self.doc_orig else doc[idx]
-                if doc == self.doc_orig and idx not in self.display_lists:
-                    self.display_lists[idx] = doc[idx].get_displaylist()
-                    page_data = self.display_lists[idx]
-                target_w, target_h = scroll.viewport().width() - 5, scroll.viewport().height() - 5
-                zoom = min(target_w / doc[idx].rect.width, target_h / doc[idx].rect.height)
-                pix = page_data.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
-                lab.setPixmap(QPixmap.fromImage(QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format.Format_RGB888)))
-            except: pass
-        render_to_label(self.doc_orig, self.lab_orig, self.scroll_orig)
-        if self.doc_clean: render_to_label(self.doc_clean, self.lab_clean, self.scroll_clean)
+        direction = -1 if idx < self.last_page else 1; self.last_page = idx
+        sizes = self.preview_sizes()
+        for key, size in sizes.items():
+            img = self.renderer.cached(key, idx, size)
+            if img is not None: self.on_preview_rendered(key, idx, size, img)
+        self.renderer.request(idx, sizes, direction)
+
+    def on_preview_rendered(self, key, idx, size, img):
+        # 丢弃已过期的结果；页码未变但窗口尺寸已变化时按新尺寸重新请求
+        if idx != self.page_spin.value() - 1: return
+        if self.preview_sizes().get(key) != size:
+            self.renderer.request(idx, self.preview_sizes(), 1)
+            return
+        lab = self.lab_orig if key == "orig" else self.lab_clean
+        lab.setPixmap(QPixmap.fromImage(img))
+
+    def closeEvent(self, event):
+        if self.saver is not None: self.saver.wait()
+        self.renderer.stop(); self.renderer.wait()
+        super().closeEvent(event)
 
     def load_file_dialog(self):
         path, _ = QFileDialog.getOpenFileName(self, "PDF", "", "PDF Files (*.pdf)")
         if path:
             self.add_log(f"File loaded: {os.path.basename(path)}")
             self.doc_orig = fitz.open(path); self.file_path = path
-            self.display_lists = {}; self.doc_clean = None
+            self.doc_clean = None
+            self.renderer.set_document("orig", fitz.open(path)); self.renderer.set_document("clean", None)
             self.page_spin.setRange(1, len(self.doc_orig)); self.page_spin.setValue(1)
             self.refresh_ui_text()
             self.update_previews()
 
+    def worker_running(self):
+        return self.worker is not None and self.worker.isRunning()
+
     def start_task(self):
+        if self.worker_running():
+            self.add_log("Cancelling...")
+            self.worker.cancel(); self.btn_clean.setEnabled(False)
+            return
         if not self.doc_orig: return
         self.pbar.setValue(0)
-        self.worker = MasterWorker(self.file_path, self.ratio_threshold)
+        self.start_trace()
+        self.worker = CleanPipeline(self.file_path, self.ratio_threshold, self.fast_mode, self.object_mode, self.near_mode, self.use_templates)
         self.worker.progress.connect(self.pbar.setValue)
         self.worker.log_signal.connect(self.add_log)
         self.worker.need_confirm.connect(self.ask_user)
         self.worker.finished.connect(self.task_done)
+        self.worker.cancelled.connect(self.task_stopped)
         self.worker.start()
+        self.btn_clean.setText(TRANSLATIONS[self.lang]["cancel"])
+
+    def task_stopped(self):
+        self.worker.wait()
+        self.btn_clean.setEnabled(True); self.refresh_ui_text()
+        if self.trace_path:
+            tracing.log_summary(self.add_log)
+            self.add_log(f">>> Trace written to {self.export_trace()}")
+
+    def start_trace(self):
+        # 每次清理重新开始记录；保存时再次导出，trace 中包含保存阶段
+        if not self.trace:
+            tracing.stop(); self.trace_path = None
+            return
+        tracing.start()
+        stem = os.path.splitext(os.path.basename(self.file_path))[0]
+        self.trace_path = os.path.join(default_cache_dir(), "traces", f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+
+    def export_trace(self):
+        os.makedirs(os.path.dirname(self.trace_path), exist_ok=True)
+        return tracing.export_chrome(self.trace_path)
 
     def ask_user(self, ic, tc):
-        dialog = EnhancedWatermarkDialog(ic, tc, self.doc_orig, lang=self.lang, scale=self.scale, parent=self)
+        dialog = EnhancedWatermarkDialog(ic, tc, self.doc_orig, lang=self.lang, scale=self.scale, parent=self, aliases=self.worker.aliases)
         if dialog.exec():
             h, t = dialog.get_selection()
-            self.worker.confirmed_hashes, self.worker.confirmed_texts = h, t
             self.add_log(f"User confirmed: {len(h)} images, {len(t)} text blocks selected.")
+            self.worker.confirm(h, t)
         else:
             self.add_log("Clean process cancelled by user.")
-        self.worker.is_confirmed = True
+            self.worker.cancel()
 
     def task_done(self, doc):
-        self.doc_clean = doc; self.btn_save.setEnabled(True); self.update_previews()
+        self.doc_clean = doc; self.renderer.set_document("clean", doc)
+        self.btn_save.setEnabled(True); self.update_previews()
+        self.task_stopped()
 
     def save_as_pdf(self):
         path, _ = QFileDialog.getSaveFileName(self, "Save", f"cleaned_{os.path.basename(self.file_path)}", "PDF (*.pdf)")
         if path: 
-            self.doc_clean.save(path, garbage=4, deflate=True)
-            self.add_log(f"Saved to: {path}")
+            self.btn_save.setEnabled(False); self.btn_clean.setEnabled(False)
+            self.pbar.setRange(0, 0)
+            self.saver = SaveWorker(self.doc_clean, path, self.save_profile, self.renderer.lock)
+            self.saver.log_signal.connect(self.add_log)
+            self.saver.saved.connect(self.save_done)
+            self.saver.start()
+
+    def save_done(self, path):
+        self.saver.wait()
+        self.pbar.setRange(0, 100); self.pbar.setValue(100 if path else 0)
+        self.btn_save.setEnabled(True); self.btn_clean.setEnabled(True)
+        if path: self.add_log(f"Saved to: {path}")
+        if path and self.trace_path: self.export_trace()
 
 if __name__ == "__main__":
     import multiprocessing
@@ -0,0 +1,319 @@
+# Extreme PDF Cleaner 常驻服务：监视输入目录 / 本地 socket 接收任务，排队后用常驻进程池逐个清理
+# 用法: python -m service --watch ./inbox --results ./outbox --rules ./rules
+#       python -m service --results ./outbox --listen 127.0.0.1:8765 --auto
+# socket 协议为逐行 JSON：{"cmd": "submit", "path": "/data/a.pdf", "rules": "可选规则文件"} / {"cmd": "status"} / {"cmd": "job", "id": 3}
+import os
+import sys
+import json
+import math
+import time
+import glob
+import queue
+import shutil
+import argparse
+import threading
+import socketserver
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from cache import AnalysisCache
+from templates import TemplateLibrary, make_template, clean_with_template, default_template_dir
+from engine import (analyze, clean_parallel, save_document, default_workers, disable_warm_documents, load_rules, make_rules,
+                    rules_match, select_by_rules, Cancelled, SAVE_PROFILES)
+
+JOB_HISTORY = 1000  # 内存中保留的已完成任务数
+
+def log(text):
+    print(f"[{time.strftime('%H:%M:%S')}] {text}", file=sys.stderr, flush=True)
+
+def percentile(values, q):
+    # 最近秩法，values 需已排序
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+def unique_path(directory, name):
+    # 同名文件已存在 (如服务重启后任务编号从 1 重新开始) 时追加序号
+    stem, ext = os.path.splitext(name)
+    path = os.path.join(directory, name); n = 1
+    while os.path.exists(path): n += 1; path = os.path.join(directory, f"{stem}-{n}{ext}")
+    return path
+
+class Job:
+    def __init__(self, job_id, path, source, rules_path=None):
+        self.id = job_id; self.path = path; self.source = source; self.rules_path = rules_path
+        self.status = "queued"; self.error = None; self.output = None; self.rules = None
+        self.images = self.texts = 0; self.template = None  # 命中模板时为 (模板名, 得分)
+        self.queued = time.time(); self.started = self.finished = None
+        self.depth = 0  # 入队时的队列深度
+
+    def to_dict(self):
+        wait = (self.started or time.time()) - self.queued
+        run = (self.finished or time.time()) - self.started if self.started else 0.0
+        return {'id': self.id, 'input': self.path, 'output': self.output, 'source': self.source, 'status': self.status,
+                'rules': self.rules, 'template': self.template and self.template[0], 'images': self.images, 'texts': self.texts, 'error': self.error,
+                'queue_depth': self.depth, 'wait_s': round(wait, 3), 'run_s': round(run, 3), 'latency_s': round(wait + run, 3)}
+
+class CleanService:
+    # 任务队列 + 若干执行线程；所有任务共用同一个进程池 (worker 内的文档缓存随之保持温热)
+    def __init__(self, executor, results_dir, rules_dir=None, ratio=30, profile="standard", fast=False, near=False,
+                 accept_all=False, cache=None, concurrency=1, templates=None, save_templates=False):
+        self.executor = executor; self.results_dir = results_dir; self.rules_dir = rules_dir
+        self.ratio = ratio / 100.0; self.profile = profile; self.fast = fast; self.near = near
+        self.accept_all = accept_all; self.cache = cache; self.concurrency = max(1, concurrency)
+        self.templates = templates; self.save_templates = save_templates
+        self.template_lock = threading.Lock()  # 多个执行线程共用一个模板库
+        self.queue = queue.Queue(); self.jobs = OrderedDict(); self.lock = threading.Lock()
+        self.next_id = 1; self.running = 0; self.completed = self.failed = 0
+        self.latencies = deque(maxlen=JOB_HISTORY)
+        self.cancel = threading.Event(); self.threads = []; self.done_callbacks = []
+        self.started = time.time()
+        os.makedirs(results_dir, exist_ok=True)
+
+    def start(self):
+        for n in range(self.concurrency):
+            t = threading.Thread(target=self.worker_loop, name=f"job-runner-{n}", daemon=True)
+            t.start(); self.threads.append(t)
+
+    def stop(self, wait=True):
+        self.cancel.set()
+        for _ in self.threads: self.queue.put(None)
+        if wait:
+            for t in self.threads: t.join()
+
+    def submit(self, path, source="socket", rules_path=None):
+        with self.lock:
+            job = Job(self.next_id, os.path.abspath(path), source, rules_path); self.next_id += 1
+            job.depth = self.queue.qsize()
+            self.jobs[job.id] = job
+            while len(self.jobs) > JOB_HISTORY:
+                oldest = next(iter(self.jobs))
+                if self.jobs[oldest].status in ("queued", "running"): break
+                self.jobs.popitem(last=False)
+        self.queue.put(job)
+        log(f">>> Job {job.id} queued: {os.path.basename(path)} (queue depth {job.depth + 1})")
+        return job
+
+    def pick_rules(self, job):
+        # 显式指定的规则文件优先；否则取规则目录中第一个 match 命中该文件名的规则 (按文件名排序)，最后才用 default.json
+        if job.rules_path: return load_rules(job.rules_path)
+        if self.rules_dir:
+            paths = sorted(glob.glob(os.path.join(self.rules_dir, "*.json")))
+            default = os.path.join(self.rules_dir, "default.json")
+            for path in [p for p in paths if p != default] + [p for p in paths if p == default]:
+                try: rules = load_rules(path)
+                except (OSError, ValueError, KeyError) as e:
+                    log(f">>> Skipping rules {path}: {e}"); continue
+                if path == default or rules_match(rules, job.path): return rules
+        return make_rules((), (), name="default", accept_all=self.accept_all)
+
+    def run_job(self, job):
+        # 显式指定规则的任务不走模板；命中模板时跳过分析，直接按模板清理
+        template = None
+        if self.templates is not None and not job.rules_path:
+            with self.template_lock: template, score = self.templates.match_file(job.path)
+        if template:
+            job.rules = template['name']; job.template = (template['name'], round(score, 3))
+            hashes, texts = template['images'], template['texts']
+            doc, cleaned = clean_with_template(job.path, template, self.executor, cancel=self.cancel)
+        else:
+            rules = self.pick_rules(job); job.rules = rules['name']
+            doc, hasher, ic, tc = analyze(job.path, self.ratio, self.executor, cache=self.cache, cancel=self.cancel,
+                                          fast=self.fast, near=self.near)
+        try:
+            if not template:
+                hashes, texts = select_by_rules(ic, tc, rules, hasher.aliases)
+                if self.save_templates and (hashes or texts): self.add_template(job, doc, hasher, hashes, texts, rules['tolerance'])
+                cleaned = clean_parallel(job.path, doc, hasher, hashes, texts, self.executor, tolerance=rules['tolerance'], cancel=self.cancel)
+            # 不同目录下的同名输入互不覆盖：输出文件名以任务编号开头
+            job.output = unique_path(self.results_dir, f"{job.id}-{os.path.basename(job.path)}")
+            save_document(cleaned, job.output, self.profile)
+            if cleaned is not doc: cleaned.close()
+            job.images, job.texts = len(hashes), len(texts)
+        finally:
+            doc.close()
+
+    def add_template(self, job, doc, hasher, hashes, texts, tolerance):
+        # 指纹取自清理前的文档；前几页没有水印时不保存
+        try: template = make_template(doc, hashes, texts, hasher.aliases, os.path.splitext(os.path.basename(job.path))[0], tolerance)
+        except ValueError as e:
+            log(f">>> Job {job.id}: template not saved: {e}"); return
+        with self.template_lock: log(f">>> Job {job.id}: template '{self.templates.add(template)}' saved.")
+
+    def worker_loop(self):
+        while True:
+            job = self.queue.get()
+            if job is None: return
+            with self.lock: self.running += 1
+            job.status = "running"; job.started = time.time()
+            try:
+                self.run_job(job); job.status = "done"
+            except Cancelled:
+                job.status = "cancelled"
+            except Exception as e:
+                job.status = "failed"; job.error = str(e)
+            job.finished = time.time()
+            with self.lock:
+                self.running -= 1
+                if job.status == "done": self.completed += 1; self.latencies.append(job.finished - job.queued)
+                elif job.status == "failed": self.failed += 1
+            self.record(job)
+            for callback in self.done_callbacks: callback(job)
+
+    def record(self, job):
+        info = job.to_dict()
+        if job.status == "done":
+            via = f"template {job.rules} {job.template[1]:.0%}" if job.template else job.rules
+            log(f">>> Job {job.id} done: {os.path.basename(job.path)} [{via}] {job.images} images, {job.texts} text lines, "
+                f"wait {info['wait_s']:.2f}s, run {info['run_s']:.2f}s, queue depth {self.queue.qsize()}")
+        else:
+            log(f">>> Job {job.id} {job.status}: {os.path.basename(job.path)} {job.error or ''}")
+        # 每个任务一行 JSON，便于事后统计
+        with self.lock:
+            with open(os.path.join(self.results_dir, "jobs.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(info, ensure_ascii=False) + "\n")
+
+    def status(self):
+        with self.lock:
+            lat = sorted(self.latencies); uptime = time.time() - self.started
+            stats = {'queue_depth': self.queue.qsize(), 'running': self.running, 'completed': self.completed,
+                     'failed': self.failed, 'uptime_s': round(uptime, 1),
+                     'throughput_per_min': round(self.completed / uptime * 60, 2) if uptime > 0 else 0.0}
+        if lat:
+            stats['latency_s'] = {'mean': round(sum(lat) / len(lat), 3), 'p50': round(percentile(lat, 0.5), 3),
+                                  'p95': round(percentile(lat, 0.95), 3), 'max': round(lat[-1], 3)}
+        return stats
+
+    def job_info(self, job_id):
+        with self.lock: job = self.jobs.get(job_id)
+        return job.to_dict() if job else None
+
+class FolderWatcher(threading.Thread):
+    # 轮询监视输入目录：文件大小 / 修改时间在相邻两次轮询间不变才入队 (避免处理尚未写完的文件)；
+    # 处理完成后移入 processed / failed 子目录；移动失败的文件记入 settled，内容变化前不再入队
+    def __init__(self, service, watch_dir, interval=1.0):
+        super().__init__(name="folder-watcher", daemon=True)
+        self.service = service; self.watch_dir = watch_dir; self.interval = interval
+        self.processed = os.path.join(watch_dir, "processed"); self.failed = os.path.join(watch_dir, "failed")
+        self.pending = {}; self.queued = set(); self.settled = {}  # settled: {path: (size, mtime_ns)}
+        self.stop_event = threading.Event()
+        service.done_callbacks.append(self.job_done)
+
+    def scan(self):
+        seen = {}; settled = {}
+        for entry in os.scandir(self.watch_dir):
+            if not entry.is_file() or not entry.name.lower().endswith(".pdf") or entry.path in self.queued: continue
+            st = entry.stat(); state = (st.st_size, st.st_mtime_ns)
+            if self.settled.get(entry.path) == state: settled[entry.path] = state
+            else: seen[entry.path] = state
+        for path, state in seen.items():
+            if self.pending.get(path) == state:
+                self.queued.add(path); self.service.submit(path, source="watch")
+        self.pending = seen; self.settled = settled
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try: self.scan()
+            except OSError as e: log(f">>> Watch error: {e}")
+            self.stop_event.wait(self.interval)
+
+    def job_done(self, job):
+        if job.source != "watch": return
+        if job.status in ("done", "failed"):
+            target = self.processed if job.status == "done" else self.failed
+            try:
+                os.makedirs(target, exist_ok=True)
+                shutil.move(job.path, unique_path(target, f"{job.id}-{os.path.basename(job.path)}"))
+            except OSError as e:
+                log(f">>> Could not move {job.path}: {e}")
+                try:
+                    st = os.stat(job.path); self.settled[job.path] = (st.st_size, st.st_mtime_ns)
+                except OSError: pass
+        self.queued.discard(job.path)
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+                if not isinstance(req, dict): raise ValueError("request must be a JSON object")
+                cmd = req.get("cmd")
+                if cmd == "submit":
+                    if not os.path.isfile(req.get("path", "")): raise ValueError(f"no such file: {req.get('path')}")
+                    job = service.submit(req["path"], rules_path=req.get("rules"))
+                    reply = {'ok': True, 'job': job.id, 'queue_depth': service.queue.qsize()}
+                elif cmd == "status":
+                    reply = {'ok': True, **service.status()}
+                elif cmd == "job":
+                    info = service.job_info(int(req.get("id", 0)))
+                    reply = {'ok': info is not None, 'job': info}
+                else:
+                    reply = {'ok': False, 'error': f"unknown command: {cmd}"}
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8")); self.wfile.flush()
+
+class LocalServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True; allow_reuse_address = True
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m service", description="Extreme PDF Cleaner watch / queue service")
+    p.add_argument("--results", required=True, help="directory for cleaned PDFs and jobs.jsonl")
+    p.add_argument("--watch", help="input directory to watch for new PDFs")
+    p.add_argument("--listen", metavar="HOST:PORT", help="accept jobs as JSON lines on a local TCP socket")
+    p.add_argument("--rules", help="directory of saved selection rules (*.json)")
+    p.add_argument("--auto", action="store_true", help="accept every detected candidate when no rules match")
+    p.add_argument("--ratio", type=int, default=30, choices=range(10, 101), metavar="10-100")
+    p.add_argument("--profile", choices=sorted(SAVE_PROFILES), default="standard", help="output profile")
+    p.add_argument("--workers", type=int, default=default_workers())
+    p.add_argument("--jobs", type=int, default=1, help="documents processed concurrently (sharing the pool)")
+    p.add_argument("--fast", action="store_true")
+    p.add_argument("--near-dup", action="store_true")
+    p.add_argument("--no-cache", action="store_true")
+    p.add_argument("--templates", nargs="?", const=default_template_dir(), metavar="DIR",
+                   help="match inputs against the template library and skip analysis on a hit (default library if DIR is omitted)")
+    p.add_argument("--save-templates", action="store_true", help="with --templates: save each analyzed job's selection as a new template")
+    p.add_argument("--interval", type=float, default=1.0, help="watch polling interval (s)")
+    p.add_argument("--report", type=float, default=60.0, help="log queue / latency stats every N seconds (0 = off)")
+    return p
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.watch and not args.listen:
+        log("Nothing to do: give --watch and/or --listen."); return 2
+    # 工作进程不常驻打开输入文档：处理完的文件要被移走，保持打开会让 Windows 上的移动失败
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=disable_warm_documents) as executor:
+        service = CleanService(executor, args.results, args.rules, args.ratio, args.profile, args.fast, args.near_dup,
+                               args.auto, None if args.no_cache else AnalysisCache(), args.jobs,
+                               TemplateLibrary(args.templates) if args.templates else None, args.save_templates)
+        # 预先拉起全部工作进程，第一个任务不必承担进程启动开销
+        for f in [executor.submit(os.getpid) for _ in range(max(1, args.workers))]: f.result()
+        service.start()
+        watcher = server = None
+        if args.watch:
+            os.makedirs(args.watch, exist_ok=True)
+            watcher = FolderWatcher(service, args.watch, args.interval); watcher.start()
+            log(f">>> Watching {os.path.abspath(args.watch)}")
+        if args.listen:
+            server = LocalServer(parse_address(args.listen), RequestHandler); server.service = service
+            threading.Thread(target=server.serve_forever, name="socket-server", daemon=True).start()
+            log(f">>> Listening on {server.server_address[0]}:{server.server_address[1]}")
+        log(f">>> Service ready: {max(1, args.workers)} pool workers, {service.concurrency} job runners.")
+        try:
+            while True:
+                time.sleep(args.report or 3600)
+                if args.report: log(f">>> Status: {json.dumps(service.status())}")
+        except KeyboardInterrupt:
+            log(">>> Shutting down...")
+        finally:
+            if watcher: watcher.stop_event.set()
+            if server: server.shutdown()
+            service.stop()
+    return 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
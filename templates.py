@@ -0,0 +1,164 @@
+# 水印模板库：确认过的选择 (图像原始 key + 文本 key) 连同文档快速指纹一起保存，
+# 同一来源的新文档命中模板时跳过分析，直接按模板清理
+# 指纹取前几页的页面尺寸，以及其中出现的每个已确认选择 (一组标记：图像为该选择的全部原始 key，文本为文本行 key)；
+# 新文档前几页出现组内任一标记即算该选择命中，得分 = 命中的选择数 / 选择总数
+# index.json 为 标记 -> (模板, 组) 的倒排索引，匹配时只需读取索引和命中的那一个模板
+import os
+import json
+import fitz
+from cache import default_cache_dir
+from tracing import span
+from engine import ImageHasher, LOSSLESS_FILTERS, text_key64, expand_aliases, make_rules, save_rules, load_rules, clean_parallel
+
+TEMPLATE_VERSION = 2  # 版本 1 的指纹每个标记自成一组，仍可读取
+FINGERPRINT_PAGES = 3
+MATCH_THRESHOLD = 0.8  # 模板标记在新文档前几页中出现的比例下限
+
+def default_template_dir():
+    return os.path.join(default_cache_dir(), "templates")
+
+def page_features(doc, pages=FINGERPRINT_PAGES):
+    # 前几页的 (页面尺寸列表, {图像标记}, {文本标记: (text, bbox, size)})；图像 key 不经别名合并，与清理时的原始 key 一致
+    hasher = ImageHasher(doc); sizes = []; images = set(); texts = {}
+    for i in range(min(pages, len(doc))):
+        page = doc[i]; size = (round(page.rect.width, 1), round(page.rect.height, 1)); sizes.append(size)
+        for img in page.get_images():
+            try: images.add("i:" + hasher.hash(img[0]))
+            except Exception: continue
+        for b in page.get_text("dict")["blocks"]:
+            if b["type"] != 0: continue
+            for line in b["lines"]:
+                content = "".join([s["text"] for s in line["spans"]]).strip()
+                if len(content) > 1:
+                    bbox = tuple([round(v, 1) for v in line["bbox"]])
+                    texts[f"t:{text_key64(content, bbox, size):x}"] = (content, bbox, size)
+    return sizes, images, texts
+
+def make_template(doc, confirmed_hashes, confirmed_texts, aliases=None, name="", tolerance=0.0, pages=FINGERPRINT_PAGES):
+    # aliases 为分析时的 ImageHasher.aliases：确认的合并 key 要展开回各自的原始 key，新文档不经分析时只会得到原始 key
+    # 前几页中找不到任何已确认的水印时无法建立指纹，抛出 ValueError
+    raw = expand_aliases(confirmed_hashes, aliases)
+    keys = set((t['text'], tuple(t['bbox']), tuple(t['size'])) for t in confirmed_texts)
+    sizes, images, texts = page_features(doc, pages)
+    variants = {h: {h} for h in confirmed_hashes}
+    for h, a in (aliases or {}).items():
+        if a in variants: variants[a].add(h)
+    marks = [sorted("i:" + k for k in group) for group in variants.values() if any("i:" + k in images for k in group)]
+    marks += [[m] for m, key in sorted(texts.items()) if key in keys]
+    if not marks: raise ValueError(f"no confirmed watermark on the first {pages} pages to fingerprint")
+    template = make_rules(raw, confirmed_texts, name=name, tolerance=tolerance)
+    template['fingerprint'] = {'version': TEMPLATE_VERSION, 'pages': pages, 'sizes': [list(s) for s in sizes], 'marks': marks}
+    return template
+
+class TemplateLibrary:
+    def __init__(self, template_dir=None, threshold=MATCH_THRESHOLD):
+        self.template_dir = template_dir or default_template_dir()
+        self.threshold = threshold
+        self.index = None
+
+    def _path(self, template_id):
+        return os.path.join(self.template_dir, f"{template_id}.json")
+
+    def _files(self):
+        try: names = os.listdir(self.template_dir)
+        except OSError: return {}
+        files = {}
+        for name in names:
+            if not name.endswith(".json") or name == "index.json": continue
+            try: files[name[:-5]] = os.stat(os.path.join(self.template_dir, name)).st_mtime_ns
+            except OSError: continue
+        return files
+
+    def load_index(self):
+        # 模板文件有增删改 (含手工编辑) 时重建索引
+        files = self._files()
+        if self.index is None:
+            try:
+                with open(os.path.join(self.template_dir, "index.json"), encoding="utf-8") as f: self.index = json.load(f)
+            except (OSError, ValueError): self.index = None
+        if self.index is None or self.index.get('version') != TEMPLATE_VERSION or self.index.get('files') != files:
+            self.index = self.rebuild(files)
+        return self.index
+
+    def rebuild(self, files):
+        index = {'version': TEMPLATE_VERSION, 'files': {}, 'marks': {}, 'meta': {}}
+        for template_id, mtime in files.items():
+            try: fp = load_rules(self._path(template_id)).get('fingerprint')
+            except (OSError, ValueError, KeyError): fp = None
+            index['files'][template_id] = mtime
+            if not fp or fp.get('version') not in (1, TEMPLATE_VERSION) or not fp['marks']: continue
+            index['meta'][template_id] = {'sizes': fp['sizes'], 'marks': len(fp['marks']), 'pages': fp['pages']}
+            for n, group in enumerate(fp['marks']):
+                for m in ([group] if isinstance(group, str) else group): index['marks'].setdefault(m, []).append([template_id, n])
+        if files:
+            path = os.path.join(self.template_dir, "index.json")
+            try:
+                with open(f"{path}.tmp", "w", encoding="utf-8") as f: json.dump(index, f, ensure_ascii=False)
+                os.replace(f"{path}.tmp", path)
+            except OSError: pass
+        return index
+
+    def add(self, template):
+        os.makedirs(self.template_dir, exist_ok=True)
+        base = "".join(c if c.isalnum() or c in "-_" else "_" for c in template['name']) or "template"
+        template_id = base; n = 1
+        while os.path.exists(self._path(template_id)): n += 1; template_id = f"{base}-{n}"
+        save_rules(self._path(template_id), template)
+        self.index = None
+        return template_id
+
+    def __len__(self):
+        return len(self.load_index()['meta'])
+
+    def match(self, doc):
+        # 返回 (模板, 得分)：得分为模板中各选择在新文档前几页中命中的比例，没有模板达到阈值时返回 (None, 0.0)
+        index = self.load_index()
+        if not index['meta']: return None, 0.0
+        pages = max(meta['pages'] for meta in index['meta'].values())
+        sizes, images, texts = page_features(doc, pages)
+        hits = set()
+        for m in list(images) + list(texts):
+            hits.update((template_id, n) for template_id, n in index['marks'].get(m, ()))
+        votes = {}
+        for template_id, _ in hits: votes[template_id] = votes.get(template_id, 0) + 1
+        best = None
+        for template_id, n in votes.items():
+            meta = index['meta'][template_id]; score = n / meta['marks']
+            if score < self.threshold or not set(map(tuple, meta['sizes'])) & set(sizes): continue
+            if best is None or (score, n) > best[:2]: best = (score, n, template_id)
+        if best is None: return None, 0.0
+        try: return load_rules(self._path(best[2])), best[0]
+        except (OSError, ValueError, KeyError): return None, 0.0
+
+    def match_file(self, file_path):
+        with span("template.match"), fitz.open(file_path) as doc: return self.match(doc)
+
+def resolve_template_aliases(doc, hasher, images, pages=FINGERPRINT_PAGES):
+    # 新文档中同一 logo 可能换了无损编码：前几页的无损图像按解码内容分组，组内有模板 key (原始或合并 key) 时
+    # 整组映射到该内容 key，写入 hasher.aliases；返回需要一并删除的内容 key
+    confirmed = set(images); groups = {}
+    for i in range(min(pages, len(doc))):
+        for img in doc[i].get_images():
+            try:
+                h = hasher.hash(img[0])
+                if hasher.signature(img[0])[0] not in LOSSLESS_FILTERS: continue
+                groups.setdefault(hasher.content_hash(img[0]), set()).add(h)
+            except Exception: continue
+    extra = []
+    for c, keys in groups.items():
+        if c in confirmed or keys & confirmed:
+            for h in keys: hasher.aliases[h] = c
+            extra.append(c)
+    return extra
+
+def clean_with_template(file_path, template, executor=None, progress=None, log=None, cancel=None, object_mode=False):
+    # 命中模板后跳过分析：直接打开文档按模板中的图像 key / 文本 key 清理，返回 (原文档, 清理结果)
+    doc = fitz.open(file_path)
+    try:
+        hasher = ImageHasher(doc)
+        images = list(template['images']) + resolve_template_aliases(doc, hasher, template['images'])
+        cleaned = clean_parallel(file_path, doc, hasher, images, template['texts'], executor, progress, log,
+                                 template['tolerance'], cancel, object_mode)
+    except BaseException:
+        doc.close(); raise
+    return doc, cleaned
@@ -0,0 +1,106 @@
+# 候选统计的行为测试：计数表合并与别名合并、快速模式验证、分析缓存、近似重复分组
+import zlib
+import fitz
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from cache import AnalysisCache, fingerprint
+from engine import CandidateTable, analyze, near_duplicate_groups
+
+SIZE = (595.0, 842.0)
+
+def twice_embedded_pdf(path, pages=10, on=(0, 1)):
+    # 同一张无损图像以两种 deflate 压缩级别各嵌入一份，只出现在 on 中的页面上
+    doc = fitz.open()
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 40, 20), 0); pix.set_rect(pix.irect, (0, 200, 0))
+    first = second = None
+    for i in range(pages):
+        page = doc.new_page(width=SIZE[0], height=SIZE[1])
+        page.insert_text((72, 300), f"Body text {i}", fontsize=11)
+        if i not in on: continue
+        if first is None:
+            first = page.insert_image(fitz.Rect(20, 20, 80, 50), stream=pix.tobytes("png"))
+            second = doc.get_new_xref()
+            doc.update_object(second, doc.xref_object(first))
+            doc.update_stream(second, zlib.compress(doc.xref_stream(first), 1), new=True, compress=False)
+            doc.xref_set_key(second, "Filter", "/FlateDecode"); doc.xref_set_key(second, "DecodeParms", "null")
+        else: page.insert_image(fitz.Rect(20, 20, 80, 50), xref=first)
+        page.insert_image(fitz.Rect(100, 20, 160, 50), xref=second)
+    doc.save(path); doc.close()
+    return path
+
+def test_aliased_keys_on_the_same_page_are_counted_once(tmp_path):
+    path = twice_embedded_pdf(str(tmp_path / "twice.pdf"))
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        doc, hasher, img_candidates, _ = analyze(path, 0.3, executor)
+    doc.close()
+    assert len(set(hasher.aliases.values())) == 1  # 两份编码确实被合并
+    assert img_candidates == {}
+
+def test_apply_aliases_counts_pages_not_keys():
+    table = CandidateTable()
+    for i in range(10):
+        imgs = [("ra", 1, None), ("rb", 2, None)] if i < 2 else [("ra", 1, None)] if i < 4 else [("rb", 2, None)] if i < 5 else []
+        table.add_page(i, SIZE, imgs, [])
+    table.apply_aliases({"ra": "c1", "rb": "c1"})
+    assert table.imgs[0] == {"c1": 5}
+    assert table.img_first["c1"][0] == 0
+
+def test_merge_matches_a_single_table():
+    pages = [[("ra", 1, None)], [("ra", 1, None), ("rb", 2, None)], [("rb", 2, None)], []]
+    whole = CandidateTable(); left = CandidateTable(); right = CandidateTable(keep_strings=False)
+    for i, imgs in enumerate(pages):
+        texts = [("Header", (72.0, 30.0, 200.0, 42.0))] + [(f"body {i}", (72.0, 300.0, 150.0, 312.0))]
+        whole.add_page(i, SIZE, imgs, texts)
+        (left if i < 2 else right).add_page(i, SIZE, imgs, texts)
+    merged = CandidateTable(keep_strings=False).merge(left).merge(right)
+    merged.apply_aliases({"ra": "c1", "rb": "c1"}); whole.apply_aliases({"ra": "c1", "rb": "c1"})
+    assert merged.imgs == whole.imgs == {0: {"c1": 3}}
+    assert merged.total_pages() == 4
+    header = [gid for gid, (text, _) in merged.strings.items() if text == "Header"]
+    assert len(header) == 1 and merged.counts[header[0]] == 4 and merged.first[header[0]] == 0
+
+def test_fast_mode_counts_text_with_the_full_scan_rule(tmp_path):
+    # 快速模式的验证阶段只按精确文本 + 取整 bbox 计数："DRAFT COPY" 不能算作 "DRAFT"
+    path = str(tmp_path / "draft.pdf")
+    doc = fitz.open()
+    for i in range(400):
+        page = doc.new_page(width=SIZE[0], height=SIZE[1])
+        page.insert_text((72, 40), "DRAFT" if i % 3 == 0 else "DRAFT COPY", fontsize=12)
+        page.insert_text((72, 300), f"Body text {i}", fontsize=11)
+    doc.save(path); doc.close()
+    counts = []
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        for fast in (False, True):
+            doc, _, _, txt_candidates = analyze(path, 0.3, executor, fast=fast); doc.close()
+            counts.append({key[0]: c['count'] for key, c in txt_candidates.items()})
+    assert counts[0] == counts[1] == {"DRAFT": 134, "DRAFT COPY": 266}
+
+def test_cache_is_reused_until_the_file_changes(tmp_path):
+    path = twice_embedded_pdf(str(tmp_path / "doc.pdf"))
+    cache = AnalysisCache(str(tmp_path / "cache"))
+    def run():
+        lines = []
+        doc, _, img_candidates, _ = analyze(path, 0.1, executor, log=lines.append, cache=cache); doc.close()
+        return any("Reusing cached scan results" in line for line in lines), img_candidates
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        first, second = run(), run()
+        assert (first[0], second[0]) == (False, True) and first[1] == second[1]
+        key = fingerprint(path)
+        doc = fitz.open(path); doc[0].insert_text((72, 500), "Changed", fontsize=11)
+        doc.save(path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP); doc.close()
+        assert fingerprint(path) != key
+        assert run()[0] is False
+        assert run()[0] is True
+
+def test_near_duplicate_groups():
+    pytest.importorskip("numpy")
+    base = 0x0F0F_3C3C_AAAA_5555
+    phashes = {
+        "ra": (100, base, (200, 30, 30)),
+        "rb": (102, base ^ 0b10110, (205, 28, 33)),           # 3 位不同、颜色与宽高比接近：同一组
+        "rc": (100, base ^ 0xFFFF_F000_0000_0000, (200, 30, 30)),  # 20 位不同
+        "rd": (100, base, (40, 200, 30)),                      # dHash 相同但颜色差得多
+        "re": (300, base, (200, 30, 30)),                      # 宽高比差得多
+    }
+    assert sorted(sorted(g) for g in near_duplicate_groups(phashes)) == [["ra", "rb"]]
+    assert near_duplicate_groups({"ra": phashes["ra"]}) == []
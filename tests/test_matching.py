@@ -0,0 +1,55 @@
+# 匹配相关的行为测试：已确认文本行的容差查找、模板库匹配
+import fitz
+from engine import ImageHasher, TextMatcher
+from templates import TemplateLibrary, make_template
+
+SIZE = (595.0, 842.0)
+HEADER = {'text': "CONFIDENTIAL", 'bbox': (72.0, 28.2, 158.0, 43.3), 'size': SIZE}
+
+def test_text_matcher_exact_and_tolerance():
+    exact = TextMatcher([HEADER])
+    assert exact.match("CONFIDENTIAL", HEADER['bbox'], SIZE)
+    assert not exact.match("CONFIDENTIAL", (72.5, 28.2, 158.0, 43.3), SIZE)
+    assert (exact.hits, exact.misses) == (1, 1)
+
+    loose = TextMatcher([HEADER], tolerance=1.0)
+    assert loose.lookup("CONFIDENTIAL", (72.5, 27.6, 158.9, 43.3), SIZE) == ("CONFIDENTIAL", HEADER['bbox'], SIZE)
+    assert loose.lookup("CONFIDENTIAL", (74.0, 28.2, 158.0, 43.3), SIZE) is None   # 超出容差
+    assert loose.lookup("CONFIDENTIAL", HEADER['bbox'], (612.0, 792.0)) is None    # 页面尺寸不同
+    assert loose.lookup("DRAFT", HEADER['bbox'], SIZE) is None
+    # 网格边界两侧 (单元格 20pt) 的 bbox 也能互相命中
+    edge = TextMatcher([{'text': "Footer", 'bbox': (39.6, 800.0, 90.0, 812.0), 'size': SIZE}], tolerance=0.5)
+    assert edge.match("Footer", (40.1, 800.0, 90.0, 812.0), SIZE)
+    assert (loose.hits, loose.misses) == (1, 3)
+
+def logo_stream(color):
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 40, 20), 0); pix.set_rect(pix.irect, color)
+    return pix.tobytes("png")
+
+def make_doc(pages=3, logo=(0, 200, 0), header="Quarterly Report"):
+    doc = fitz.open(); stream = logo_stream(logo) if logo else None
+    for i in range(pages):
+        page = doc.new_page(width=SIZE[0], height=SIZE[1])
+        if stream: page.insert_image(fitz.Rect(20, 20, 80, 50), stream=stream)
+        if header: page.insert_text((72, 80), header, fontsize=11)
+        page.insert_text((72, 300), f"Body text {i}", fontsize=11)
+    return fitz.open("pdf", doc.tobytes())
+
+def header_text(doc, header):
+    for b in doc[0].get_text("dict")["blocks"]:
+        for line in b.get("lines", ()):
+            if "".join(s["text"] for s in line["spans"]).strip() == header:
+                return {'text': header, 'bbox': tuple(round(v, 1) for v in line["bbox"]), 'size': SIZE}
+
+def test_template_library_matches_documents_from_the_same_source(tmp_path):
+    doc = make_doc()
+    logo = ImageHasher(doc).hash(doc[0].get_images()[0][0])
+    library = TemplateLibrary(str(tmp_path))
+    template_id = library.add(make_template(doc, [logo], [header_text(doc, "Quarterly Report")], name="report"))
+    assert template_id == "report" and len(library) == 1
+
+    template, score = library.match(make_doc(pages=5))
+    assert template['name'] == "report" and score == 1.0
+    # 两个选择中只命中一个 (得分 0.5) 低于阈值
+    assert library.match(make_doc(logo=(200, 0, 0))) == (None, 0.0)
+    assert library.match(make_doc(logo=None, header=None)) == (None, 0.0)
@@ -0,0 +1,83 @@
+# 对象级清理的行为测试：用 PyMuPDF 生成 PDF，清理、保存后重新打开检查像素与文本
+import fitz
+from engine import ImageHasher, clean_objects, content_tokens, text_blocks
+
+LOGO = fitz.Rect(20, 60, 80, 90)
+HEADER = "CONFIDENTIAL"
+
+def logo_png():
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 40, 20), 0)
+    pix.set_rect(pix.irect, (0, 200, 0))
+    return pix.tobytes("png")
+
+def make_pdf():
+    # 4 页：每页 logo + 顶部 12pt 页眉；第 0 页另有同文字的 20pt 正文标题；第 2、3 页页眉与正文在同一个 BT 块中
+    doc = fitz.open(); logo = logo_png()
+    for i in range(4):
+        page = doc.new_page(width=595, height=842)
+        page.insert_image(LOGO, stream=logo)
+        page.insert_text((72, 40), HEADER, fontsize=12)
+        if i == 0: page.insert_text((72, 500), HEADER, fontsize=20)
+        if i < 2:
+            page.insert_text((72, 300), f"Body text {i}", fontsize=11)
+        else:
+            xref = page.get_contents()[-1]
+            data = doc.xref_stream(xref)
+            body = f"1 0 0 1 72 542 Tm <{f'Body text {i}'.encode().hex()}> Tj\nET".encode()
+            doc.update_stream(xref, data[:data.rindex(b"ET")] + body + data[data.rindex(b"ET") + 2:])
+    return fitz.open("pdf", doc.tobytes())
+
+def header_key(doc):
+    for b in doc[0].get_text("dict")["blocks"]:
+        for line in b.get("lines", ()):
+            if "".join(s["text"] for s in line["spans"]).strip() == HEADER and line["bbox"][1] < 100:
+                return {'text': HEADER, 'bbox': tuple(round(v, 1) for v in line["bbox"]), 'size': (595.0, 842.0)}
+
+def clean(doc):
+    hasher = ImageHasher(doc)
+    logo = hasher.hash(doc[0].get_images()[0][0])
+    cleaned = clean_objects(doc, hasher, [logo], [header_key(doc)])
+    return cleaned, fitz.open("pdf", cleaned.tobytes(garbage=4, deflate=True))
+
+def logo_pixel(page):
+    return page.get_pixmap(clip=LOGO).pixel(30, 15)
+
+def test_images_are_blanked_in_memory_and_after_save():
+    doc = make_pdf()
+    assert logo_pixel(doc[0]) == (0, 200, 0)
+    cleaned, saved = clean(doc)
+    for d in (cleaned, saved):
+        assert all(logo_pixel(page) == (255, 255, 255) for page in d)
+
+def test_text_is_removed_only_at_the_confirmed_position():
+    cleaned, saved = clean(make_pdf())
+    for d in (cleaned, saved):
+        for i, page in enumerate(d):
+            assert HEADER not in page.get_text(clip=fitz.Rect(0, 0, 595, 100))
+            assert f"Body text {i}" in page.get_text()
+        assert HEADER in d[0].get_text(clip=fitz.Rect(0, 450, 595, 520))
+
+def test_text_blocks_track_text_position():
+    data = b"q 1 0 0 1 10 20 cm BT /F1 12 Tf 14 TL 5 6 Td (Hello) Tj T* [(Wor) -20 (ld)] TJ ET Q BT 1 0 0 1 7 8 Tm <4869> Tj ET /Fm0 Do"
+    blocks, dos, (ctm, stack) = text_blocks(data)
+    assert [(b[2], tuple(b[3])) for b in blocks] == [("HelloWorld", (15.0, 26.0)), ("Hi", (7.0, 8.0))]
+    assert dos == [("Fm0", (1.0, 0.0, 0.0, 1.0, 0.0, 0.0))] and stack == ()
+
+def test_content_tokens_strings_and_inline_images():
+    data = b"(a\\(b\\)\\101) <41 42> BI /W 1 ID \x00EI\x01 EI ET"
+    tokens = [(kind, value) for kind, value, _, _ in content_tokens(data)]
+    assert tokens[:2] == [("str", b"a(b)A"), ("str", b"AB")]
+    assert tokens[-1] == ("op", b"ET")
+
+def test_text_in_shared_form_is_located_through_the_form_matrix():
+    stamp = fitz.open(); stamp.new_page(width=200, height=100).insert_text((10, 50), "STAMP", fontsize=12)
+    doc = fitz.open()
+    for i in range(3):
+        page = doc.new_page(width=595, height=842)
+        page.show_pdf_page(fitz.Rect(100, 700, 300, 800) if i < 2 else fitz.Rect(100, 300, 300, 400), stamp, 0)
+    doc = fitz.open("pdf", doc.tobytes())
+    line = doc[0].get_text("dict")["blocks"][0]["lines"][0]
+    key = {'text': "STAMP", 'bbox': tuple(round(v, 1) for v in line["bbox"]), 'size': (595.0, 842.0)}
+    cleaned = clean_objects(doc, ImageHasher(doc), [], [key])
+    # 第 2 页的调用位置不同，共享的块保留在内容流中，前两页改由逐页 redaction 删除
+    assert [("STAMP" in page.get_text()) for page in cleaned] == [False, False, True]
@@ -0,0 +1,151 @@
+# 阶段计时 / 性能剖析 (不依赖 PyQt6)
+# 默认关闭，span() 只返回一个空上下文；start() 之后记录的 span 可导出为 Chrome trace (chrome://tracing / Perfetto)
+# 进程池中的 span 通过 submit()/result() 随任务结果一起带回主进程，合并进同一个 trace
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+
+_enabled = False
+_profile_dir = None
+_spans = []
+_lock = threading.Lock()
+_NULL = contextlib.nullcontext()
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name; self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        event = {'name': self.name, 'ph': 'X', 'ts': self.start // 1000, 'dur': (end - self.start) // 1000,
+                 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if self.args: event['args'] = self.args
+        with _lock: _spans.append(event)
+        return False
+
+def span(name, **args):
+    # with span("scan.text", page=i): ...
+    return _Span(name, args) if _enabled else _NULL
+
+def enabled():
+    return _enabled
+
+def start(profile_dir=None):
+    # 开始新的一次记录；profile_dir 不为空时主进程和 worker 都用 cProfile 采样，.prof 文件写入该目录
+    global _enabled, _profile_dir
+    with _lock: _spans.clear()
+    _enabled = True; _profile_dir = profile_dir
+    if profile_dir: os.makedirs(profile_dir, exist_ok=True)
+
+def stop():
+    global _enabled, _profile_dir
+    _enabled = False; _profile_dir = None
+
+def drain():
+    with _lock:
+        spans = list(_spans); _spans.clear()
+    return spans
+
+def spans():
+    with _lock: return list(_spans)
+
+# --- 进程池任务 ---
+class TracedResult:
+    # 子进程返回值 + 子进程内记录的 span
+    def __init__(self, value, spans):
+        self.value = value; self.spans = spans
+
+def _traced_call(fn, args, profile_dir):
+    global _enabled
+    with _lock: _spans.clear()
+    _enabled = True
+    profiler = cProfile.Profile() if profile_dir else None
+    try:
+        if profiler: profiler.enable()
+        value = fn(*args)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(profile_dir, f"worker-{os.getpid()}-{time.perf_counter_ns()}.prof"))
+        _enabled = False
+    return TracedResult(value, drain())
+
+def submit(executor, fn, *args):
+    # 记录开启时把任务包一层，让子进程同样记录 span；关闭时与 executor.submit 完全相同
+    if not _enabled: return executor.submit(fn, *args)
+    return executor.submit(_traced_call, fn, args, _profile_dir)
+
+def result(future):
+    value = future.result()
+    if isinstance(value, TracedResult):
+        with _lock: _spans.extend(value.spans)
+        value = value.value
+    return value
+
+# --- 导出 / 汇总 ---
+def export_chrome(path, events=None):
+    events = spans() if events is None else events
+    main_pid = os.getpid()
+    meta = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'main' if pid == main_pid else f'worker {pid}'}}
+            for pid in sorted(set(e['pid'] for e in events))]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({'traceEvents': meta + events, 'displayTimeUnit': 'ms'}, f)
+    return path
+
+def summarize(events=None):
+    # 按 span 名称汇总：次数、总耗时、平均、最大 (毫秒)，按总耗时降序
+    events = spans() if events is None else events
+    stats = {}
+    for e in events:
+        s = stats.setdefault(e['name'], [0, 0, 0])
+        s[0] += 1; s[1] += e['dur']; s[2] = max(s[2], e['dur'])
+    rows = [(name, n, total / 1000, total / n / 1000, peak / 1000) for name, (n, total, peak) in stats.items()]
+    return sorted(rows, key=lambda r: -r[2])
+
+def log_summary(log, events=None, top=12, slowest=5):
+    events = spans() if events is None else events
+    if not log or not events: return
+    log(f">>> Trace: {len(events)} spans from {len(set(e['pid'] for e in events))} processes.")
+    for name, n, total, mean, peak in summarize(events)[:top]:
+        log(f">>>   {name:<16} {n:>6}x  total {total:>9.1f} ms  mean {mean:>7.2f} ms  max {peak:>8.1f} ms")
+    # 最慢的单个 span (带参数，定位到具体页面 / 文件)
+    detailed = sorted((e for e in events if e.get('args')), key=lambda e: -e['dur'])[:slowest]
+    for e in detailed:
+        args = ", ".join(f"{k}={v}" for k, v in e['args'].items())
+        log(f">>>   slowest {e['name']} ({args}): {e['dur'] / 1000:.1f} ms")
+
+@contextlib.contextmanager
+def profiled(path, log=None, top=15):
+    # 对单次运行做 cProfile：主进程结果与 worker 的 .prof 合并后写入 path，并在日志中列出累计耗时最高的函数
+    profile_dir = path + ".parts"
+    start(profile_dir)
+    profiler = cProfile.Profile(); profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable(); stop()
+        stats = pstats.Stats(profiler)
+        for name in sorted(os.listdir(profile_dir)):
+            part = os.path.join(profile_dir, name)
+            try: stats.add(part)
+            except Exception: pass
+            os.remove(part)
+        os.rmdir(profile_dir)
+        stats.dump_stats(path)
+        if log:
+            out = io.StringIO(); stats.stream = out; stats.files = []
+            stats.strip_dirs().sort_stats("cumulative").print_stats(top)
+            log(f">>> Profile written to {path}")
+            for line in out.getvalue().splitlines():
+                if line.strip(): log(line)